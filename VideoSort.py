@@ -223,6 +223,19 @@
 # from file names.
 #DNZBHeaders=yes
 
+# Maximum number of words of an nfo file compared with the nzb name.
+#
+# When Direct-NZB headers are used, nfo files having other names than the
+# video file are scanned for words similar to the nzb name, which assigns
+# them to the video file. Scanning stops after this number of words which
+# can be release names, or after <DeepScanTime>.
+#DeepScanWords=500
+
+# Maximum time to scan an nfo file (seconds).
+#
+# See option <DeepScanWords>.
+#DeepScanTime=5
+
 # Use name of nzb-file instead of name of video file (yes, no).
 #
 # Good indexer nzb-sites do renaming and cleanup of nzb-file
@@ -240,6 +253,20 @@
 # unique suffixes are added at the end of file names, e.g. My.Show.(2).mkv.
 #Overwrite=no
 
+# How files are placed at destination (move, hardlink, reflink, copy).
+#
+# move     - files are moved (copied and deleted if the destination is on
+#            another filesystem);
+# hardlink - hard links to the files are created, the downloaded files
+#            remain (for seeding); files are copied if the destination is
+#            on another filesystem;
+# reflink  - the files are cloned without copying of data on filesystems
+#            supporting it (btrfs, XFS), otherwise they are copied;
+# copy     - the files are copied.
+#
+# The download directory is not cleaned up unless the files are moved.
+#PlacementMode=move
+
 # Delete download directory after renaming (yes, no).
 #
 # If after successful sorting all remaining files in the download directory
@@ -259,6 +286,84 @@
 # For debugging or if you need to report a bug.
 #Verbose=no
 
+# Number of processes for guessing (1-16).
+#
+# Downloads with many video files (such as season packs) are sorted
+# faster if the file names are analyzed by several processes in parallel.
+# The files are still moved one after another in the original order.
+#GuessProcesses=1
+
+# Path of the guess cache.
+#
+# Results of guessit are stored in an SQLite database and reused when the
+# same names are sorted again (post-process again, library re-sort,
+# duplicates), which saves the time of guessing. Names are cached per
+# version of guessit.
+#
+# Leave empty to not cache results.
+#GuessCache=
+
+# Maximum number of names in the guess cache.
+#
+# The least recently used names are removed when the cache grows beyond
+# this size.
+#GuessCacheSize=100000
+
+# Path of the rules snapshot.
+#
+# Building the rules of guessit compiles hundreds of regular expressions
+# on each start of the script. The compiled expressions are saved in the
+# rules snapshot and loaded on the next start instead. The snapshot is
+# rebuilt when the version of Python, guessit or rebulk changes. Each
+# version of Python has a snapshot of its own, the version is added to
+# the file name (e.g. "videosort-rules.py39.snapshot").
+#
+# Leave empty to keep the snapshot in the temporary directory of NZBGet
+# (option "TempDir"), or of the system when the script is run from the
+# command line.
+#RulesSnapshot=
+
+# Socket of VideoSort daemon.
+#
+# Loading of guessit library takes time on each start of the script.
+# A daemon started with "python VideoSort.py --daemon <socket>" keeps
+# the library loaded and sorts downloads handed over by the script
+# through the unix socket. If the daemon isn't running the download is
+# sorted by the script as usual.
+#
+# Leave empty to always sort in the script.
+#DaemonSocket=
+
+# Path of the undo log.
+#
+# Each run appends the file operations it made (moves, links and copies,
+# created directories, deleted files) to the undo log. The last run can be
+# rolled back with "python VideoSort.py --rollback <undo log>". Rolled back
+# runs are removed from the log, other runs are kept; delete the file to
+# start over.
+#
+# Leave empty to not keep an undo log.
+#UndoLog=
+
+# Path of the metrics file.
+#
+# Wall and CPU time of each phase of a run (guessing, moving, etc.) and of
+# each video file, and counters such as guessit calls and bytes copied are
+# logged as detail messages after each run. They are also appended to this
+# file, one JSON object per line.
+#
+# Leave empty to only log the metrics.
+#MetricsFile=
+
+# Path of the Prometheus metrics file.
+#
+# Metrics of the last run are written in the text format of the textfile
+# collector of the Prometheus node exporter, for example to
+# "/var/lib/node_exporter/textfile_collector/videosort.prom".
+#
+# Leave empty to not write Prometheus metrics.
+#PrometheusFile=
+
 ### NZBGET POST-PROCESSING SCRIPT                                           ###
 ##############################################################################
 
@@ -270,119 +375,312 @@ import os
 import traceback
 import re
 import shutil
-import guessit
 import difflib
+import datetime
+import errno
+import io
+from collections import OrderedDict
+import getopt
+import json
+import contextlib
+import hashlib
+import marshal
+import multiprocessing
+import signal
+import socket
+import tempfile
+import time
 
 import six
 
+# The guessit library is imported on first use (see "load_guessit") so that
+# handing a download over to the sorter daemon doesn't pay for its import
+guessit = None
+
+# Guessit api for subtitle languages and its results per file name suffix
+subtitle_api = None
+subtitle_languages = {}
+
 # Exit codes used by NZBGet
 POSTPROCESS_SUCCESS=93
 POSTPROCESS_NONE=95
 POSTPROCESS_ERROR=94
 
-# Check if the script is called from nzbget 11.0 or later
-if not 'NZBOP_SCRIPTDIR' in os.environ:
-    print('*** NZBGet post-processing script ***')
-    print('This script is supposed to be called from nzbget (11.0 or later).')
-    sys.exit(POSTPROCESS_ERROR)
-
-# Check if directory still exist (for post-process again)
-if not os.path.exists(os.environ['NZBPP_DIRECTORY']):
-    print('[INFO] Destination directory %s doesn\'t exist, exiting' % os.environ['NZBPP_DIRECTORY'])
-    sys.exit(POSTPROCESS_NONE)
-
-# Check par and unpack status for errors
-if os.environ['NZBPP_PARSTATUS'] == '1' or os.environ['NZBPP_PARSTATUS'] == '4' or os.environ['NZBPP_UNPACKSTATUS'] == '1':
-    print('[WARNING] Download of "%s" has failed, exiting' % (os.environ['NZBPP_NZBNAME']))
-    sys.exit(POSTPROCESS_NONE)
-
-# Check if all required script config options are present in config file
-required_options = ('NZBPO_MoviesDir', 'NZBPO_SeriesDir', 'NZBPO_DatedDir',
-    'NZBPO_OtherTvDir', 'NZBPO_VideoExtensions', 'NZBPO_SatelliteExtensions', 'NZBPO_MinSize',
-    'NZBPO_MoviesFormat', 'NZBPO_SeriesFormat', 'NZBPO_OtherTvFormat', 'NZBPO_DatedFormat',
-    'NZBPO_EpisodeSeparator', 'NZBPO_Overwrite', 'NZBPO_Cleanup', 'NZBPO_LowerWords', 'NZBPO_UpperWords',
-    'NZBPO_TvCategories', 'NZBPO_Preview', 'NZBPO_Verbose')
-for optname in required_options:
-    if (not optname.upper() in os.environ):
-        print('[ERROR] Option %s is missing in configuration file. Please check script settings' % optname[6:])
-        sys.exit(POSTPROCESS_ERROR)
-
-# Init script config options
-nzb_name=os.environ['NZBPP_NZBNAME']
-download_dir=os.environ['NZBPP_DIRECTORY']
-movies_format=os.environ['NZBPO_MOVIESFORMAT']
-series_format=os.environ['NZBPO_SERIESFORMAT']
-dated_format=os.environ['NZBPO_DATEDFORMAT']
-othertv_format=os.environ['NZBPO_OTHERTVFORMAT']
-multiple_episodes=os.environ['NZBPO_MULTIPLEEPISODES']
-episode_separator=os.environ['NZBPO_EPISODESEPARATOR']
-movies_dir=os.environ['NZBPO_MOVIESDIR']
-series_dir=os.environ['NZBPO_SERIESDIR']
-dated_dir=os.environ['NZBPO_DATEDDIR']
-othertv_dir=os.environ['NZBPO_OTHERTVDIR']
-video_extensions=os.environ['NZBPO_VIDEOEXTENSIONS'].replace(' ', '').lower().split(',')
-satellite_extensions=os.environ['NZBPO_SATELLITEEXTENSIONS'].replace(' ', '').lower().split(',')
-min_size=int(os.environ['NZBPO_MINSIZE'])
-min_size <<= 20
-overwrite=os.environ['NZBPO_OVERWRITE'] == 'yes'
-cleanup=os.environ['NZBPO_CLEANUP'] == 'yes'
-preview=os.environ['NZBPO_PREVIEW'] == 'yes'
-verbose=os.environ['NZBPO_VERBOSE'] == 'yes'
-satellites=len(satellite_extensions)>0
-lower_words=os.environ['NZBPO_LOWERWORDS'].replace(' ', '').split(',')
-upper_words=os.environ['NZBPO_UPPERWORDS'].replace(' ', '').split(',')
-series_year=os.environ.get('NZBPO_SERIESYEAR', 'yes') == 'yes'
-
-tv_categories=os.environ['NZBPO_TVCATEGORIES'].lower().split(',')
-category=os.environ.get('NZBPP_CATEGORY', '')
-force_tv=category.lower() in tv_categories
-
-dnzb_headers=os.environ.get('NZBPO_DNZBHEADERS', 'yes') == 'yes'
-dnzb_proper_name=os.environ.get('NZBPR__DNZB_PROPERNAME', '')
-dnzb_episode_name=os.environ.get('NZBPR__DNZB_EPISODENAME', '')
-dnzb_movie_year=os.environ.get('NZBPR__DNZB_MOVIEYEAR', '')
-dnzb_more_info=os.environ.get('NZBPR__DNZB_MOREINFO', '')
-prefer_nzb_name=os.environ.get('NZBPO_PREFERNZBNAME', '') == 'yes'
-use_nzb_name=False
-
-# NZBPO_DNZBHEADERS must also be enabled
-deep_scan = dnzb_headers
+# Prefixes of environment variables passed by NZBGet to the script
+NZBGET_ENV_PREFIXES = ('NZBOP_', 'NZBPO_', 'NZBPP_', 'NZBPR_')
+
+# Cross-filesystem copying of files (see "copy_file"): ioctl request for
+# cloning of files (Linux), size of parts after which the progress is
+# recorded in the move journal, buffer size for copying in the script and
+# errors meaning a method isn't supported
+FICLONE = 0x40049409
+COPY_CHUNK_SIZE = 256 << 20
+COPY_BUFFER_SIZE = 8 << 20
+COPY_UNSUPPORTED_ERRORS = frozenset(getattr(errno, name) for name in
+    ('EOPNOTSUPP', 'ENOTSUP', 'ENOTTY', 'EXDEV', 'EINVAL', 'ENOSYS', 'EBADF', 'EPERM')
+    if hasattr(errno, name))
+
+# Index of the first copy method to try per pair of devices (source, destination)
+copy_method_cache = {}
+
+# Name of the journal of copies in progress, stored in source directory
+MOVE_JOURNAL = '.videosort-journal'
+
+# Default name of the rules snapshot (option "RulesSnapshot")
+RULES_SNAPSHOT = 'videosort-rules.snapshot'
+
+# Open undo log of the current run (see "log_undo")
+undo_log = None
+
+# Counters of run metrics (see "run_metrics")
+METRIC_COUNTERS = ('guessit_calls', 'guess_cache_hits', 'stat_calls', 'renames', 'copies', 'links', 'clones', 'bytes_copied')
+
+# Placement modes (option "PlacementMode") and their log messages
+PLACEMENT_VERBS = {'move': 'Moved', 'hardlink': 'Linked', 'reflink': 'Cloned', 'copy': 'Copied'}
+
 # difflib match threshold. Anything below is not considered a match
 deep_scan_ratio = 0.60
 
-if preview:
-    print('[WARNING] *** PREVIEW MODE ON - NO CHANGES TO FILE SYSTEM ***')
+# Minimum length and part of letters and digits of words in nfo files
+# which can be release names (all other words are "artwork" and the like)
+deep_scan_min_length = 4
+deep_scan_min_alnum = 0.6
 
-if verbose and force_tv:
-    print('[INFO] Forcing TV sorting (category: %s)' % category)
-
-# List of moved files (source path)
-moved_src_files = []
+def load_options():
+    """ Reads script options and properties of the nzb-file from the environment.
+        Returns exit code if the download must not be processed, otherwise None.
+    """
+    global nzb_name, download_dir, movies_format, series_format, dated_format, othertv_format, \
+        multiple_episodes, episode_separator, movies_dir, series_dir, dated_dir, othertv_dir, \
+        video_extensions, satellite_extensions, min_size, overwrite, cleanup, preview, verbose, \
+        satellites, lower_words, upper_words, series_year, tv_categories, category, force_tv, \
+        dnzb_headers, dnzb_proper_name, dnzb_episode_name, dnzb_movie_year, dnzb_more_info, \
+        prefer_nzb_name, use_nzb_name, deep_scan, moved_files, dir_listings, dupe_numbers, existing_dirs, undo_log_path, undo_run, undo_log, dupe_separator, placement_mode, \
+        guess_processes, format_programs, title_cache, metrics, metrics_path, prometheus_path, \
+        guess_cache_path, guess_cache_size, deep_scan_candidates, deep_scan_time
+
+    # Check if directory still exist (for post-process again)
+    if not os.path.exists(os.environ['NZBPP_DIRECTORY']):
+        print('[INFO] Destination directory %s doesn\'t exist, exiting' % os.environ['NZBPP_DIRECTORY'])
+        return POSTPROCESS_NONE
+
+    # Check par and unpack status for errors
+    if os.environ['NZBPP_PARSTATUS'] == '1' or os.environ['NZBPP_PARSTATUS'] == '4' or os.environ['NZBPP_UNPACKSTATUS'] == '1':
+        print('[WARNING] Download of "%s" has failed, exiting' % (os.environ['NZBPP_NZBNAME']))
+        return POSTPROCESS_NONE
+
+    # Check if all required script config options are present in config file
+    required_options = ('NZBPO_MoviesDir', 'NZBPO_SeriesDir', 'NZBPO_DatedDir',
+        'NZBPO_OtherTvDir', 'NZBPO_VideoExtensions', 'NZBPO_SatelliteExtensions', 'NZBPO_MinSize',
+        'NZBPO_MoviesFormat', 'NZBPO_SeriesFormat', 'NZBPO_OtherTvFormat', 'NZBPO_DatedFormat',
+        'NZBPO_EpisodeSeparator', 'NZBPO_Overwrite', 'NZBPO_Cleanup', 'NZBPO_LowerWords', 'NZBPO_UpperWords',
+        'NZBPO_TvCategories', 'NZBPO_Preview', 'NZBPO_Verbose')
+    for optname in required_options:
+        if (not optname.upper() in os.environ):
+            print('[ERROR] Option %s is missing in configuration file. Please check script settings' % optname[6:])
+            return POSTPROCESS_ERROR
+
+    # Init script config options
+    nzb_name=os.environ['NZBPP_NZBNAME']
+    download_dir=os.environ['NZBPP_DIRECTORY']
+    movies_format=os.environ['NZBPO_MOVIESFORMAT']
+    series_format=os.environ['NZBPO_SERIESFORMAT']
+    dated_format=os.environ['NZBPO_DATEDFORMAT']
+    othertv_format=os.environ['NZBPO_OTHERTVFORMAT']
+    multiple_episodes=os.environ['NZBPO_MULTIPLEEPISODES']
+    episode_separator=os.environ['NZBPO_EPISODESEPARATOR']
+    movies_dir=os.environ['NZBPO_MOVIESDIR']
+    series_dir=os.environ['NZBPO_SERIESDIR']
+    dated_dir=os.environ['NZBPO_DATEDDIR']
+    othertv_dir=os.environ['NZBPO_OTHERTVDIR']
+    video_extensions=os.environ['NZBPO_VIDEOEXTENSIONS'].replace(' ', '').lower().split(',')
+    satellite_extensions=os.environ['NZBPO_SATELLITEEXTENSIONS'].replace(' ', '').lower().split(',')
+    min_size=int(os.environ['NZBPO_MINSIZE'])
+    min_size <<= 20
+    overwrite=os.environ['NZBPO_OVERWRITE'] == 'yes'
+    cleanup=os.environ['NZBPO_CLEANUP'] == 'yes'
+    preview=os.environ['NZBPO_PREVIEW'] == 'yes'
+    verbose=os.environ['NZBPO_VERBOSE'] == 'yes'
+    satellites=len(satellite_extensions)>0
+    lower_words=os.environ['NZBPO_LOWERWORDS'].replace(' ', '').split(',')
+    upper_words=os.environ['NZBPO_UPPERWORDS'].replace(' ', '').split(',')
+    series_year=os.environ.get('NZBPO_SERIESYEAR', 'yes') == 'yes'
+    guess_processes=max(1, int(os.environ.get('NZBPO_GUESSPROCESSES', '1')))
+    guess_cache_path=os.environ.get('NZBPO_GUESSCACHE', '')
+    guess_cache_size=max(1, int(os.environ.get('NZBPO_GUESSCACHESIZE', '100000')))
+
+    tv_categories=os.environ['NZBPO_TVCATEGORIES'].lower().split(',')
+    category=os.environ.get('NZBPP_CATEGORY', '')
+    force_tv=category.lower() in tv_categories
+
+    dnzb_headers=os.environ.get('NZBPO_DNZBHEADERS', 'yes') == 'yes'
+    dnzb_proper_name=os.environ.get('NZBPR__DNZB_PROPERNAME', '')
+    dnzb_episode_name=os.environ.get('NZBPR__DNZB_EPISODENAME', '')
+    dnzb_movie_year=os.environ.get('NZBPR__DNZB_MOVIEYEAR', '')
+    dnzb_more_info=os.environ.get('NZBPR__DNZB_MOREINFO', '')
+    prefer_nzb_name=os.environ.get('NZBPO_PREFERNZBNAME', '') == 'yes'
+    use_nzb_name=False
+
+    # NZBPO_DNZBHEADERS must also be enabled
+    deep_scan = dnzb_headers
+    deep_scan_candidates=max(1, int(os.environ.get('NZBPO_DEEPSCANWORDS', '500')))
+    deep_scan_time=float(os.environ.get('NZBPO_DEEPSCANTIME', '5'))
+
+    if preview:
+        print('[WARNING] *** PREVIEW MODE ON - NO CHANGES TO FILE SYSTEM ***')
+
+    if verbose and force_tv:
+        print('[INFO] Forcing TV sorting (category: %s)' % category)
+
+    placement_mode = os.environ.get('NZBPO_PLACEMENTMODE', 'move')
+    if placement_mode not in PLACEMENT_VERBS:
+        print('[WARNING] Unknown placement mode %s, moving files' % placement_mode)
+        placement_mode = 'move'
+
+    # Moved files (source and destination paths)
+    moved_files = move_registry()
+
+    # Names of files in destination directories (see "unique_name")
+    dir_listings = {}
+
+    # Suffix per duplicate name where the search for a free one continues
+    # (see "unique_name")
+    dupe_numbers = {}
+
+    # Destination directories known to exist (see "make_dir")
+    existing_dirs = set()
+
+    # Undo log (see "log_undo"), the log of a previous daemon job is closed
+    if undo_log:
+        undo_log.close()
+    undo_log_path = os.environ.get('NZBPO_UNDOLOG', '')
+    undo_run = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f') + ' ' + str(os.getpid())
+    # False: disabled, None: opened on first operation
+    undo_log = None if undo_log_path else False
+
+    # Metrics of the run (see "report_metrics")
+    metrics = run_metrics()
+    metrics_path = os.environ.get('NZBPO_METRICSFILE', '')
+    prometheus_path = os.environ.get('NZBPO_PROMETHEUSFILE', '')
 
-# List of moved files (destination path)
-moved_dst_files = []
+    dupe_separator = ' '
 
-# Separator character used between file name and opening brace
-# for duplicate files such as "My Movie (2).mkv"
-dupe_separator = ' '
+    # Compiled sort strings (see "path_subst")
+    format_programs = {}
 
+    # Titles computed for elements (see "cached_titles")
+    title_cache = {}
 
-class deprecation_support:
-    """Class implementing iterator for deprecation message support"""
+    analyze_formats()
 
-    def __init__(self, mapping):
-        self.iter = iter(mapping)
+    return None
 
-    def __iter__(self):
-        return self
+# Separator character used between file name and opening brace
+# for duplicate files such as "My Movie (2).mkv"
+dupe_separator = ' '
 
-    def __next__(self):
-        map_entry = next(self.iter)
-        return map_entry if len(map_entry) >= 3 else list(map_entry) + [None]
 
-    def next(self):
-        return self.__next__()
+class file_inventory:
+    """Files of a directory tree with their sizes and kinds (video, satellite, other).
+       The tree is scanned once; the inventory is updated when files are moved.
+    """
 
+    def __init__(self, root, recursive=True):
+        self.root = root
+        self.recursive = recursive
+        # directory -> (file name -> (size, kind)); directories in order of os.walk
+        self.dirs = OrderedDict()
+        self.scan()
+
+    def scan(self):
+        stack = [self.root]
+        while stack:
+            dir = stack.pop()
+            files = self.dirs.setdefault(dir, OrderedDict())
+            subdirs = []
+            try:
+                for name, is_dir, descend, size in list_directory(dir):
+                    if is_dir:
+                        if descend and self.recursive:
+                            subdirs.append(os.path.join(dir, name))
+                    else:
+                        files[name] = (size, file_kind(name))
+            except OSError as e:
+                print('[WARNING] %s' % e)
+            subdirs.reverse()
+            stack.extend(subdirs)
+
+    def files(self, directory=None, recursive=True):
+        """ Returns list of tuples (path, size, kind) of files in directory
+            and (if recursive) its subdirectories
+        """
+        prefix = directory and os.path.join(directory, '')
+        result = []
+        for dir, files in self.dirs.items():
+            if directory is None or dir == directory or (recursive and dir.startswith(prefix)):
+                for name, (size, kind) in files.items():
+                    result.append((os.path.join(dir, name), size, kind))
+        return result
+
+    def contains(self, path):
+        files = self.dirs.get(os.path.dirname(path))
+        return files is not None and os.path.basename(path) in files
+
+    def discard(self, path):
+        """ Removes file from the inventory (if it's there) """
+        files = self.dirs.get(os.path.dirname(path))
+        if files is not None:
+            files.pop(os.path.basename(path), None)
+
+    def move(self, old, new):
+        """ Updates the inventory after file 'old' was moved to 'new' """
+        files = self.dirs.get(os.path.dirname(old))
+        if files is None or os.path.basename(old) not in files:
+            return
+        size, kind = files.pop(os.path.basename(old))
+        if new.startswith(os.path.join(self.root, '')) and \
+                (self.recursive or os.path.dirname(new) == self.root):
+            name = os.path.basename(new)
+            self.dirs.setdefault(os.path.dirname(new), OrderedDict())[name] = (size, file_kind(name))
+
+def list_directory(dir):
+    """ Yields name, directory flag, descend flag (not a link) and size
+        (None if unknown) for each entry of directory
+    """
+    if hasattr(os, 'scandir'):
+        for entry in os.scandir(dir):
+            if entry.is_dir():
+                yield entry.name, True, not entry.is_symlink(), None
+            else:
+                metrics.count('stat_calls')
+                try:
+                    size = entry.stat().st_size
+                except OSError:
+                    size = None
+                yield entry.name, False, False, size
+    else:
+        for name in os.listdir(dir):
+            path = os.path.join(dir, name)
+            metrics.count('stat_calls')
+            if os.path.isdir(path):
+                yield name, True, not os.path.islink(path), None
+            else:
+                metrics.count('stat_calls')
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    size = None
+                yield name, False, False, size
+
+def file_kind(filename):
+    """ Returns kind of file by its extension: video, satellite or other """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in video_extensions:
+        return 'video'
+    elif ext in satellite_extensions:
+        return 'satellite'
+    else:
+        return 'other'
 
 def guess_dupe_separator(format):
     """ Find out a char most suitable as dupe_separator
@@ -402,51 +700,584 @@ def guess_dupe_separator(format):
             dupe_separator = '_'
             return
 
+class move_registry:
+    """Source and destination paths of moved files (ordered sets)"""
+
+    def __init__(self):
+        self.sources = OrderedDict()
+        self.destinations = OrderedDict()
+
+    def add(self, old, new):
+        self.sources[old] = None
+        self.destinations[new] = None
+
+    def moved_to(self, path):
+        return path in self.destinations
+
+    def destination_dirs(self):
+        """ Returns list of directories of destination paths in order of moves """
+        return list(OrderedDict((os.path.dirname(path), None) for path in self.destinations))
+
+def cpu_time():
+    """ Returns CPU time (user and system) of this process in seconds """
+    times = os.times()
+    return times[0] + times[1]
+
+class run_metrics:
+    """Wall and CPU time per phase and per video file, and counters of a run.
+       Phases may be nested (deep scan is part of satellites).
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.start_cpu = cpu_time()
+        # phase -> [wall time, cpu time, number of times]
+        self.phases = OrderedDict()
+        # video file -> (phase -> [wall time, cpu time])
+        self.files = OrderedDict()
+        self.counters = OrderedDict((name, 0) for name in METRIC_COUNTERS)
+
+    @contextlib.contextmanager
+    def phase(self, name, path=None):
+        """ Measures the enclosed block as phase name (of video file path) """
+        wall, cpu = time.time(), cpu_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - wall, cpu_time() - cpu, path)
+
+    def add(self, name, wall, cpu, path=None, count=1):
+        totals = self.phases.setdefault(name, [0.0, 0.0, 0])
+        totals[0] += wall
+        totals[1] += cpu
+        totals[2] += count
+        if path is not None:
+            times = self.files.setdefault(path, OrderedDict()).setdefault(name, [0.0, 0.0])
+            times[0] += wall
+            times[1] += cpu
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def merge(self, other):
+        """ Adds metrics of a guessing worker (see "construct_path_task") """
+        for name, (wall, cpu, count) in other.phases.items():
+            self.add(name, wall, cpu, count=count)
+        for path, phases in other.files.items():
+            for name, (wall, cpu) in phases.items():
+                times = self.files.setdefault(path, OrderedDict()).setdefault(name, [0.0, 0.0])
+                times[0] += wall
+                times[1] += cpu
+        for name, value in other.counters.items():
+            self.count(name, value)
+
+# Metrics of the current run (replaced for each run by "load_options")
+metrics = run_metrics()
+
+def report_metrics(exit_code):
+    """ Logs metrics of the run and writes them to the metrics files (options
+        <MetricsFile> and <PrometheusFile>). Returns exit_code.
+    """
+    wall = time.time() - metrics.start
+    cpu = cpu_time() - metrics.start_cpu
+    print('[DETAIL] Run took %.2f s (cpu %.2f s)' % (wall, cpu))
+    for name, (phase_wall, phase_cpu, count) in metrics.phases.items():
+        print('[DETAIL] Phase %s: %.2f s (cpu %.2f s), %i times' % (name, phase_wall, phase_cpu, count))
+    print('[DETAIL] Counters: %s' % ', '.join('%s %i' % item for item in metrics.counters.items()))
+    if verbose:
+        for path, phases in metrics.files.items():
+            print('[DETAIL] File %s: %s' % (os.path.basename(path), ', '.join(
+                '%s %.3f s (cpu %.3f s)' % (name, times[0], times[1]) for name, times in phases.items())))
+
+    try:
+        if metrics_path:
+            write_metrics(metrics_path, exit_code, wall, cpu)
+        if prometheus_path:
+            write_prometheus(prometheus_path, exit_code, wall, cpu)
+    except (IOError, OSError) as e:
+        print('[WARNING] Could not write metrics: %s' % e)
+    return exit_code
+
+def write_metrics(path, exit_code, wall, cpu):
+    """ Appends metrics of the run to file path, as json line """
+    def times(wall, cpu):
+        return OrderedDict([('wall', round(wall, 4)), ('cpu', round(cpu, 4))])
+
+    phases = OrderedDict()
+    for name, (phase_wall, phase_cpu, count) in metrics.phases.items():
+        phases[name] = times(phase_wall, phase_cpu)
+        phases[name]['count'] = count
+    files = OrderedDict()
+    for file, file_phases in metrics.files.items():
+        files[file] = OrderedDict((name, times(*item)) for name, item in file_phases.items())
+    record = OrderedDict([('run', undo_run), ('directory', os.environ.get('NZBPP_DIRECTORY')), ('exit_code', exit_code),
+        ('wall', round(wall, 4)), ('cpu', round(cpu, 4)), ('phases', phases),
+        ('counters', metrics.counters), ('files', files)])
+    with open(path, 'a') as file:
+        file.write(json.dumps(record) + '\n')
+
+def write_prometheus(path, exit_code, wall, cpu):
+    """ Writes metrics of the run to file path in the text format of the
+        Prometheus node exporter (replaced atomically)
+    """
+    lines = []
+
+    def gauge(name, help, samples):
+        lines.append('# HELP videosort_%s %s' % (name, help))
+        lines.append('# TYPE videosort_%s gauge' % name)
+        for labels, value in samples:
+            lines.append('videosort_%s%s %s' % (name, labels, value))
+
+    gauge('run_timestamp_seconds', 'Start time of the last run.', [('', metrics.start)])
+    gauge('run_exit_code', 'Exit code of the last run.', [('', exit_code)])
+    gauge('run_wall_seconds', 'Wall time of the last run.', [('', wall)])
+    gauge('run_cpu_seconds', 'CPU time of the last run.', [('', cpu)])
+    gauge('run_video_files', 'Video files processed by the last run.', [('', len(metrics.files))])
+    for index, name, help in ((0, 'phase_wall_seconds', 'Wall time'), (1, 'phase_cpu_seconds', 'CPU time'),
+            (2, 'phase_count', 'Number of times')):
+        gauge(name, '%s of phases of the last run.' % help,
+            [('{phase="%s"}' % phase, totals[index]) for phase, totals in metrics.phases.items()])
+    for name, value in metrics.counters.items():
+        gauge(name, 'Counter %s of the last run.' % name, [('', value)])
+
+    temp = path + '.tmp'
+    with open(temp, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    os.rename(temp, path)
+
+def dir_listing(dir):
+    """ Returns set of file names in directory, the directory is listed once
+        per run (files moved there are known from the move registry)
+    """
+    if dir not in dir_listings:
+        try:
+            dir_listings[dir] = set(os.listdir(dir))
+        except OSError:
+            dir_listings[dir] = set()
+    return dir_listings[dir]
+
+def make_dir(dir):
+    """ Creates directory with its parents unless it's known to exist """
+    if dir in existing_dirs:
+        return
+    metrics.count('stat_calls')
+    if not os.path.isdir(dir):
+        missing = []
+        parent = dir
+        while not os.path.isdir(parent) and parent != os.path.dirname(parent):
+            missing.append(parent)
+            parent = os.path.dirname(parent)
+        try:
+            os.makedirs(dir)
+        except OSError as ex:
+            if ex.errno != errno.EEXIST:
+                raise
+        else:
+            # A new directory is empty
+            dir_listings.setdefault(dir, set())
+            for parent in reversed(missing):
+                log_undo('mkdir', parent)
+    while dir not in existing_dirs and dir != os.path.dirname(dir):
+        existing_dirs.add(dir)
+        dir = os.path.dirname(dir)
+
+def make_dirs(dirs):
+    """ Creates all directories in one sorted pass (parents first) """
+    for dir in sorted(set(dirs)):
+        try:
+            make_dir(dir)
+        except OSError as ex:
+            # Reported when files are moved there
+            print('[WARNING] Could not create directory %s: %s' % (dir, ex))
+
 def unique_name(new):
     """ Adds unique numeric suffix to destination file name to avoid overwriting
         such as "filename.(2).ext", "filename.(3).ext", etc.
         If existing file was created by the script it is renamed to "filename.(1).ext".
     """
     fname, fext = os.path.splitext(new)
-    suffix_num = 2
+    existing = dir_listing(os.path.dirname(new))
+    key = (fname, dupe_separator, fext)
+    # Taken names are known from the directory listing and the move registry,
+    # no file is probed. Names are only taken during a run, so the search for
+    # the lowest free suffix continues where it stopped for the last duplicate.
+    suffix_num = dupe_numbers.get(key, 2)
     while True:
         new_name = fname + dupe_separator + '(' + str(suffix_num) + ')' + fext
-        if not os.path.exists(new_name) and new_name not in moved_dst_files:
+        if os.path.basename(new_name) not in existing and not moved_files.moved_to(new_name):
             break
         suffix_num += 1
+    dupe_numbers[key] = suffix_num
     return new_name
 
+def preallocate(dst, size):
+    """ Reserves space for the destination file if the filesystem supports it """
+    if hasattr(os, 'posix_fallocate') and size > 0:
+        try:
+            os.posix_fallocate(dst.fileno(), 0, size)
+        except OSError:
+            pass
+
+def copy_reflink(src, dst, size, offset, progress):
+    """ Clones the file (copy-on-write, no data is copied) """
+    if offset > 0:
+        raise OSError(errno.EINVAL, 'Partially copied file can not be cloned')
+    import fcntl
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+def copy_kernel(src, dst, size, offset, progress):
+    """ Copies the file within the kernel (copy_file_range or sendfile) """
+    preallocate(dst, size)
+    use_copy_file_range = hasattr(os, 'copy_file_range')
+    start = offset
+    while offset < size:
+        count = min(size - offset, COPY_CHUNK_SIZE)
+        if use_copy_file_range:
+            try:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), count, offset, offset)
+            except OSError as ex:
+                # Older kernels don't support copy_file_range across filesystems
+                if offset > start or not hasattr(os, 'sendfile') or ex.errno not in COPY_UNSUPPORTED_ERRORS:
+                    raise
+                use_copy_file_range = False
+                continue
+        else:
+            dst.seek(offset)
+            copied = os.sendfile(dst.fileno(), src.fileno(), offset, count)
+        if copied == 0:
+            break
+        offset += copied
+        progress(dst, offset)
+
+def copy_buffered(src, dst, size, offset, progress):
+    """ Copies the file through a large buffer """
+    preallocate(dst, size)
+    src.seek(offset)
+    dst.seek(offset)
+    buffer = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer)
+    reported = offset
+    while True:
+        count = src.readinto(buffer)
+        if not count:
+            break
+        dst.write(view[:count])
+        offset += count
+        if offset - reported >= COPY_CHUNK_SIZE:
+            progress(dst, offset)
+            reported = offset
+
+def copy_methods():
+    """ Returns list of tuples (name, function) of copy methods available
+        on this system, the fastest first
+    """
+    methods = []
+    if sys.platform.startswith('linux'):
+        methods.append(('reflink', copy_reflink))
+        if hasattr(os, 'copy_file_range') or hasattr(os, 'sendfile'):
+            methods.append(('kernel', copy_kernel))
+    methods.append(('buffered', copy_buffered))
+    return methods
+
+def copy_file(old, new, offset=0, progress=None):
+    """ Copies content of file old to new with the fastest method supported
+        by the source and destination filesystems, continuing a partial copy at offset.
+        Function progress(dst, offset) is called when a part of the file is
+        copied and when the copy is complete. Returns name of the used method.
+    """
+    progress = progress or (lambda dst, offset: None)
+    methods = copy_methods()
+    with io.open(old, 'rb', buffering=0) as src:
+        with io.open(new, 'r+b' if offset > 0 else 'wb', buffering=0) as dst:
+            src_stat = os.fstat(src.fileno())
+            size = src_stat.st_size
+            devices = (src_stat.st_dev, os.fstat(dst.fileno()).st_dev)
+            for index in range(copy_method_cache.get(devices, 0), len(methods)):
+                name, method = methods[index]
+                try:
+                    method(src, dst, size, offset, progress)
+                except (IOError, OSError) as ex:
+                    if index == len(methods) - 1 or ex.errno not in COPY_UNSUPPORTED_ERRORS:
+                        raise
+                    # Not supported by this filesystem, try next method
+                    continue
+                dst.truncate(size)
+                progress(dst, size)
+                copy_method_cache[devices] = index
+                return name
+
+def journal_path(path):
+    """ Returns path of the move journal for file path (in the same directory) """
+    return os.path.join(os.path.dirname(path), MOVE_JOURNAL)
+
+def temp_path(path):
+    """ Returns temporary (hidden) name for a file while it's being copied """
+    return os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.part')
+
+def load_journal(journal):
+    """ Returns moves recorded in the journal: dict of source path -> dict
+        with destination, temporary file, source size and mtime and number
+        of bytes copied
+    """
+    try:
+        with open(journal) as file:
+            moves = json.load(file)
+    except (IOError, ValueError):
+        return {}
+    return native_strings(moves)
+
+def native_strings(value):
+    """ Converts strings loaded from json to byte strings in Python 2 (paths
+        are byte strings there)
+    """
+    if not six.PY2:
+        return value
+    if isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    elif isinstance(value, dict):
+        return dict((native_strings(key), native_strings(item)) for key, item in six.iteritems(value))
+    elif isinstance(value, list):
+        return [native_strings(item) for item in value]
+    return value
+
+def save_journal(journal, moves):
+    """ Writes the journal atomically, removes it when there are no moves """
+    if not moves:
+        if os.path.exists(journal):
+            os.remove(journal)
+            if inventory is not None:
+                inventory.discard(journal)
+        return
+    temp = journal + '.tmp'
+    with open(temp, 'w') as file:
+        json.dump(moves, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.rename(temp, journal)
+
+def finish_interrupted_move(old, new):
+    """ Removes source of a journaled move which was interrupted after the
+        copy was put into place. Returns True if there was such a move.
+    """
+    journal = journal_path(old)
+    if not os.path.exists(journal):
+        return False
+    moves = load_journal(journal)
+    move = moves.get(old)
+    if not move or move['new'] != new or move['copied'] != move['size'] or \
+            os.path.exists(move['temp']) or not os.path.exists(new) or \
+            os.path.getsize(new) != move['size']:
+        return False
+    if placement_mode == 'move':
+        os.remove(old)
+    del moves[old]
+    save_journal(journal, moves)
+    return True
+
+def journaled_copy(old, new, keep_source):
+    """ Copies file old to new through a temporary file, which is renamed
+        into place when complete, and removes file old unless keep_source.
+        Progress is recorded in a journal so that a copy interrupted by a
+        crash or restart is continued by the next run.
+    """
+    start_time = time.time()
+    journal = journal_path(old)
+    temp = temp_path(new)
+    moves = load_journal(journal)
+    stat = os.stat(old)
+    move = moves.get(old)
+    offset = 0
+    if move and move['new'] == new and move['size'] == stat.st_size and \
+            move['mtime'] == stat.st_mtime and os.path.exists(temp):
+        offset = move['copied']
+        print('[INFO] Resuming interrupted copy at %.1f MB: %s' % (offset / 1024.0 / 1024.0, new))
+    move = {'new': new, 'temp': temp, 'size': stat.st_size, 'mtime': stat.st_mtime, 'copied': offset}
+    moves[old] = move
+    save_journal(journal, moves)
+
+    def checkpoint(dst, copied):
+        # Data must be on disk before it's recorded as copied
+        os.fsync(dst.fileno())
+        move['copied'] = copied
+        save_journal(journal, moves)
+
+    method = copy_file(old, temp, offset, checkpoint)
+    os.rename(temp, new)
+    if not keep_source:
+        os.remove(old)
+    del moves[old]
+    save_journal(journal, moves)
+
+    metrics.count('copies')
+    metrics.count('bytes_copied', stat.st_size - offset)
+    elapsed = max(time.time() - start_time, 0.001)
+    size = stat.st_size / 1024.0 / 1024.0
+    print('[DETAIL] Copied %.1f MB in %.1f s (%.1f MB/s, %s copy)' % (size, elapsed, size / elapsed, method))
+
 def optimized_move(old, new):
     try:
         os.rename(old, new)
+        metrics.count('renames')
     except OSError as ex:
         print('[DETAIL] Rename failed ({}), performing copy: {}'.format(ex, new))
-        shutil.copyfile(old, new)
-        os.remove(old)
+        journaled_copy(old, new, False)
 
-def rename(old, new):
+def clone_file(old, new):
+    """ Clones file old as new (reflink), no data is copied """
+    with io.open(old, 'rb', buffering=0) as src:
+        try:
+            with io.open(new, 'wb', buffering=0) as dst:
+                copy_reflink(src, dst, 0, 0, None)
+        except (IOError, OSError):
+            if os.path.exists(new):
+                os.remove(new)
+            raise
+
+def place_file(old, new):
+    """ Places file old at new according to the placement mode. Returns the
+        placement mode used (copy if links or clones are not supported).
+    """
+    if placement_mode == 'move':
+        optimized_move(old, new)
+        log_undo('move', new, old)
+        return placement_mode
+    if placement_mode != 'copy':
+        try:
+            if placement_mode == 'hardlink':
+                os.link(old, new)
+                metrics.count('links')
+            else:
+                clone_file(old, new)
+                metrics.count('clones')
+            log_undo('copy', new, old)
+            return placement_mode
+        except (IOError, OSError) as ex:
+            print('[DETAIL] %s failed (%s), performing copy: %s' % (placement_mode.capitalize(), ex, new))
+    journaled_copy(old, new, True)
+    log_undo('copy', new, old)
+    return 'copy'
+
+def log_undo(operation, path, source=None):
+    """ Appends file operation to the undo log: 'move' (file moved from source
+        to path), 'copy' (path is a copy or link of source), 'mkdir' (directory
+        path created) or 'delete' (path deleted, can't be undone)
+    """
+    global undo_log
+    if undo_log is None:
+        try:
+            undo_log = open(undo_log_path, 'a')
+        except IOError as e:
+            print('[WARNING] Could not open undo log: %s' % e)
+            undo_log = False
+    if undo_log:
+        record = OrderedDict([('run', undo_run), ('op', operation), ('path', path)])
+        if source is not None:
+            record['source'] = source
+        undo_log.write(json.dumps(record) + '\n')
+        undo_log.flush()
+
+def stat_exists(path):
+    """ Returns True if path exists (counted as stat call) """
+    metrics.count('stat_calls')
+    return os.path.exists(path)
+
+def rename(old, new, free=False):
     """ Moves the file to its sorted location.
         It creates any necessary directories to place the new file and moves it.
+        If free is True the new name is known to be free (see "unique_name").
     """
-    if os.path.exists(new) or new in moved_dst_files:
-        if overwrite and new not in moved_dst_files:
+    # The inventory holds files yet to be sorted, placed files are removed
+    # from it also if they remain in the download directory (placement mode)
+    if not preview and finish_interrupted_move(old, new):
+        print('[INFO] Finished interrupted move: %s' % new)
+        log_undo('move' if placement_mode == 'move' else 'copy', new, old)
+        inventory.move(old, new)
+    elif not free and (stat_exists(new) or moved_files.moved_to(new)):
+        if overwrite and not moved_files.moved_to(new):
             os.remove(new)
-            optimized_move(old, new)
+            if not preview:
+                log_undo('delete', new)
+            place_file(old, new)
             print('[INFO] Overwrote: %s' % new)
+            inventory.move(old, new)
         else:
             # rename to filename.(2).ext, filename.(3).ext, etc.
             new = unique_name(new)
-            rename(old, new)
+            rename(old, new, True)
     else:
+        mode = placement_mode
         if not preview:
-            if not os.path.exists(os.path.dirname(new)):
-                os.makedirs(os.path.dirname(new))
-            optimized_move(old, new)
-        print('[INFO] Moved: %s' % new)
-    moved_src_files.append(old)
-    moved_dst_files.append(new)
+            make_dir(os.path.dirname(new))
+            mode = place_file(old, new)
+        print('[INFO] %s: %s' % (PLACEMENT_VERBS[mode], new))
+        inventory.move(old, new)
+    moved_files.add(old, new)
     return new
 
+class satellite_index:
+    """Satellite files of a directory tree indexed by lower-cased base name
+       (without subtitle language), plus nfo files as deep scan candidates.
+    """
+
+    def __init__(self, files):
+        # base name -> list of (order, path, subtitle language part)
+        self.bases = {}
+        # list of (order, path, lower-cased base name)
+        self.nfos = []
+        # (nfo path, nzb name) -> deep scan result; the index can outlive a
+        # download (daemon, re-sort) and the result depends on the nzb name
+        self.deep_scans = {}
+        order = 0
+        for fpath, size, kind in files:
+            if kind != 'satellite':
+                continue
+            order += 1
+            filename = os.path.basename(fpath)
+            fbase, fext = os.path.splitext(filename)
+            fextlo = fext.lower()
+
+            # Handle subtitles and nfo files
+            subpart = ''
+            # We support GuessIt supported subtitle extensions
+            if fextlo[1:] in ['srt', 'idx', 'sub', 'ssa', 'ass']:
+                lang = guess_subtitle_language(filename)
+                if lang is not None:
+                    fbase = fbase[:fbase.rfind('.')]
+                    # Use alpha2 subtitle language from GuessIt (en, es, de, etc.)
+                    subpart = '.' + lang.alpha2
+                if verbose:
+                    if subpart != '':
+                        print('Satellite: %s is a subtitle [%s]' % (filename, lang))
+                    else:
+                        # English (or undetermined)
+                        print('Satellite: %s is a subtitle' % filename)
+            elif fextlo == '.nfo':
+                self.nfos.append((order, fpath, fbase.lower()))
+            self.bases.setdefault(fbase.lower(), []).append((order, fpath, subpart))
+
+    def find(self, base):
+        """ Returns list of tuples (path, subtitle language part, reason) of
+            satellites belonging to video file with base name, in directory order
+        """
+        base = base.lower()
+        found = [(order, fpath, subpart, 'subtitle (%s)' % subpart[1:] if subpart else 'same name')
+            for order, fpath, subpart in self.bases.get(base, []) if inventory.contains(fpath)]
+        if deep_scan:
+            for order, fpath, fbase in self.nfos:
+                # Aggressive match attempt
+                if fbase != base and inventory.contains(fpath) and self.deep_scan(fpath) is not None:
+                    # Guess details are not important, just that there was a match
+                    found.append((order, fpath, '', 'nfo deep scan'))
+        found.sort()
+        return [(fpath, subpart, reason) for order, fpath, subpart, reason in found]
+
+    def deep_scan(self, fpath):
+        key = (fpath, nzb_name)
+        if key not in self.deep_scans:
+            with metrics.phase('deep scan'):
+                self.deep_scans[key] = deep_scan_nfo(fpath)
+        return self.deep_scans[key]
+
 def move_satellites(videofile, dest):
     """ Moves satellite files such as subtitles that are associated with base
         and stored in root to the correct dest.
@@ -457,70 +1288,73 @@ def move_satellites(videofile, dest):
     root = os.path.dirname(videofile)
     destbasenm = os.path.splitext(dest)[0]
     base = os.path.basename(os.path.splitext(videofile)[0])
-    for (dirpath, dirnames, filenames) in os.walk(root):
-        for filename in filenames:
-            fbase, fext = os.path.splitext(filename)
-            fextlo = fext.lower()
-            fpath = os.path.join(dirpath, filename)
-
-            if fextlo in satellite_extensions:
-                # Handle subtitles and nfo files
-                subpart = ''
-                # We support GuessIt supported subtitle extensions
-                if fextlo[1:] in ['srt', 'idx', 'sub', 'ssa', 'ass']:
-                    guess = guessit.guessit(filename)
-                    if guess and 'subtitle_language' in guess:
-                        fbase = fbase[:fbase.rfind('.')]
-                        # Use alpha2 subtitle language from GuessIt (en, es, de, etc.)
-                        subpart = '.' + guess['subtitle_language'][0].alpha2
-                    if verbose:
-                        if subpart != '':
-                            print('Satellite: %s is a subtitle [%s]' % (filename, guess['subtitle_language'][0]))
-                        else:
-                            # English (or undetermined)
-                            print('Satellite: %s is a subtitle' % filename)
-                elif (fbase.lower() != base.lower()) and fextlo == '.nfo':
-                    # Aggressive match attempt
-                    if deep_scan:
-                        guess = deep_scan_nfo(fpath)
-                        if guess is not None:
-                            # Guess details are not important, just that there was a match
-                            fbase = base
-                if fbase.lower() == base.lower():
-                    old = fpath
-                    new = destbasenm + subpart + fext
-                    if verbose:
-                        print('Satellite: %s' % os.path.basename(new))
-                    rename(old, new)
-
+    if download_dir == os.path.splitext(videofile)[0]:
+        # Video file lying loose in the library (re-sort): only files of the
+        # same base name next to it belong to it, not the rest of the library
+        prefix = base.lower() + '.'
+        index = satellite_index([file for file in inventory.files(root, recursive=False)
+            if os.path.basename(file[0]).lower().startswith(prefix)])
+    else:
+        index = satellite_indexes.get(root)
+        if index is None:
+            index = satellite_indexes[root] = satellite_index(inventory.files(root))
+    for old, subpart, reason in index.find(base):
+        new = destbasenm + subpart + os.path.splitext(old)[1]
+        if verbose:
+            print('Satellite: %s' % os.path.basename(new))
+        new = rename(old, new)
+        add_plan_record(old, new, 'satellite', '%s for %s' % (reason, os.path.basename(videofile)))
+
+
+def nfo_words(filename):
+    """ Yields words of nfo file which can be release names, each word once """
+    seen = set()
+    with open(filename, 'rb') as nfo:
+        for line in nfo:
+            for word in line.split():
+                if len(word) < deep_scan_min_length or word in seen:
+                    continue
+                seen.add(word)
+                try:
+                    word = word.decode('ascii')
+                except UnicodeDecodeError:
+                    # Ignore non-ascii words (common in nfo "artwork")
+                    continue
+                alnum = sum(1 for char in word if char.isalnum())
+                if alnum >= len(word) * deep_scan_min_alnum:
+                    yield word
 
 def deep_scan_nfo(filename, ratio=deep_scan_ratio):
     if verbose:
         print('Deep scanning satellite: %s (ratio=%.2f)' % (filename, ratio))
     best_guess = None
     best_ratio = 0.00
+    # Compare words against NZB name
+    diff = difflib.SequenceMatcher()
+    diff.set_seq2(nzb_name)
+    start_time = time.time()
     try:
-        nfo = open(filename)
-        # Convert file content into iterable words
-        for word in ''.join([item for item in nfo.readlines()]).split():
-            try:
-                guess = guessit.guessit(word + '.nfo')
+        for count, word in enumerate(nfo_words(filename)):
+            if count >= deep_scan_candidates or time.time() - start_time > deep_scan_time:
+                if verbose:
+                    print('Deep scan stopped after %i words' % count)
+                break
+            diff.set_seq1(word)
+            # Upper bounds of the ratio are cheap, check them first
+            if diff.real_quick_ratio() < ratio or diff.quick_ratio() < ratio:
+                continue
+            word_ratio = diff.ratio()
+            if verbose:
+                print('Tested: %s (ratio=%.2f)' % (word, word_ratio))
+            # Evaluate ratio against threshold and previous matches
+            if word_ratio >= ratio and word_ratio > best_ratio:
+                guess = cached_guessit(six.text_type(word + '.nfo'))
                 # Series = TV, Title = Movie
-                if any(item in guess for item in ('title')):
-                    # Compare word against NZB name
-                    diff = difflib.SequenceMatcher(None, word, nzb_name)
-                    # Evaluate ratio against threshold and previous matches
+                if 'title' in guess:
                     if verbose:
-                        print('Tested: %s (ratio=%.2f)' % (word, diff.ratio()))
-                    if diff.ratio() >= ratio and diff.ratio() > best_ratio:
-                        if verbose:
-                            print('Possible match found: %s (ratio=%.2f)' % (word, diff.ratio()))
-                        best_guess = guess
-                        best_ratio = diff.ratio()
-            except UnicodeDecodeError:
-                # Ignore non-unicode words (common in nfo "artwork")
-                pass
-        nfo.close()
+                        print('Possible match found: %s (ratio=%.2f)' % (word, word_ratio))
+                    best_guess = guess
+                    best_ratio = word_ratio
     except IOError as e:
         print('[ERROR] %s' % str(e))
     return best_guess
@@ -533,25 +1367,29 @@ def cleanup_download_dir():
     if verbose:
         print('Cleanup')
 
+    if placement_mode != 'move':
+        print('[INFO] Skipping clean up, files were not moved (placement mode: %s)' % placement_mode)
+        return
+
+    # Moved files are no longer in the inventory (also in preview mode)
+    remaining_files = inventory.files(download_dir)
+
     # Check if there are any big files remaining
-    for root, dirs, files in os.walk(download_dir):
-        for filename in files:
-            path = os.path.join(root, filename)
-            # Check minimum file size
-            if os.path.getsize(path) >= min_size and (not preview or path not in moved_src_files):
-                print('[WARNING] Skipping clean up due to large files remaining in the directory')
-                return
+    for path, size, kind in remaining_files:
+        # Check minimum file size (unknown size is considered big)
+        if size is None or size >= min_size:
+            print('[WARNING] Skipping clean up due to large files remaining in the directory')
+            return
 
     # Now delete all files with nice logging
-    for root, dirs, files in os.walk(download_dir):
-        for filename in files:
-            path = os.path.join(root, filename)
-            if not preview or path not in moved_src_files:
-                if not preview:
-                    os.remove(path)
-                print('[INFO] Deleted: %s' % path)
+    for path, size, kind in remaining_files:
+        if not preview:
+            os.remove(path)
+            log_undo('delete', path)
+        print('[INFO] Deleted: %s' % path)
     if not preview:
         shutil.rmtree(download_dir)
+        log_undo('delete', download_dir)
     print('[INFO] Deleted: %s' % download_dir)
 
 STRIP_AFTER = ('_', '.', '-')
@@ -568,42 +1406,70 @@ REPLACE_AFTER = {
     '--': '-'
 }
 
-def path_subst(path, mapping):
+def compile_format(path, mapping):
+    """ Splits the sort string into literal text and elements.
+        path = the sort string
+        mapping = array of tuples that maps all elements to their values
+        Returns list of tuples (text, element); one of both is None.
+    """
+    # Longest elements are tried first, e.g. "%sn" before "%s"
+    keys = sorted(set([entry[0] for entry in mapping]), key=lambda key: (-len(key), key))
+
+    program = []
+    text = ''
+    n = 0
+    while True:
+        pos = path.find('%', n)
+        if pos == -1:
+            text += path[n:]
+            break
+        text += path[n:pos]
+        for key in keys:
+            if path.startswith(key, pos):
+                if text:
+                    program.append((text, None))
+                    text = ''
+                program.append((None, key))
+                n = pos + len(key)
+                break
+        else:
+            # Not an element, copy literally
+            text += '%'
+            n = pos + 1
+    if text:
+        program.append((text, None))
+    return program
+
+def path_subst(path, mapping, vtype):
     """ Replace the sort sting elements by real values.
         Non-elements are copied literally.
         path = the sort string
         mapping = array of tuples that maps all elements to their values
+                  and optionally to a deprecation message;
+                  a value can be a function computing it
+        vtype = video type; sort strings are compiled once per video type
     """
+    program = format_programs.get((vtype, path))
+    if program is None:
+        program = compile_format(path, mapping)
+        format_programs[(vtype, path)] = program
+        used = set([key for text, key in program])
+        for entry in mapping:
+            if len(entry) >= 3 and entry[0] in used:
+                print('[WARNING] specifier %s is deprecated, %s' % (entry[0], entry[2]))
+
+    values = {}
+    for entry in mapping:
+        values.setdefault(entry[0], entry[1])
+
+    # Only the values of elements used in the sort string are computed
     newpath = []
-    plen = len(path)
-    n = 0
-
-    # Sort list of mapping tuples by their first elements. First ascending by element,
-    # then descending by element length.
-    # Preparation to replace elements from longest to shortest in alphabetical order.
-    #
-    # >>> m = [('bb', 4), ('aa', 3), ('b', 6), ('aaa', 2), ('zzzz', 1), ('a', 5)]
-    # >>> m.sort(key=lambda t: t[0])
-    # >>> m
-    # [('a', 5), ('aa', 3), ('aaa', 2), ('b', 6), ('bb', 4), ('zzzz', 1)]
-    # >>> m.sort(key=lambda t: len(t[0]), reverse=True)
-    # >>> m
-    # [('zzzz', 1), ('aaa', 2), ('aa', 3), ('bb', 4), ('a', 5), ('b', 6)]
-    mapping.sort(key=lambda t: t[0])
-    mapping.sort(key=lambda t: len(t[0]), reverse=True)
-
-    while n < plen:
-        result = path[n]
-        if result == '%':
-            for key, value, msg in deprecation_support(mapping):
-                if path.startswith(key, n):
-                    n += len(key)-1
-                    result = value
-                    if msg:
-                        print('[WARNING] specifier %s is deprecated, %s' % (key, msg))
-                    break
-        newpath.append(result)
-        n += 1
+    for text, key in program:
+        if key is not None:
+            text = values[key]
+            if callable(text):
+                text = text()
+        newpath.append(text)
     return ''.join(newpath)
 
 def get_titles(name, titleing=False):
@@ -744,36 +1610,45 @@ except:
 
 # END * From SABnzbd+ * END
 
+def cached_titles(name, titleing):
+    """ Returns function computing titles of 'name' (see "get_titles") on first use.
+        The titles are shared between all files of the download.
+    """
+    def titles():
+        key = (name, titleing)
+        result = title_cache.get(key)
+        if result is None:
+            result = get_titles(name, titleing)
+            title_cache[key] = result
+        return result
+    return titles
+
+def add_titles_mapping(mapping, name, titleing, keys):
+    """ Maps three elements to title of 'name' with words separated with spaces,
+        dots and underscores. The titles are computed only if the elements are used.
+    """
+    titles = cached_titles(name, titleing)
+    for n, key in enumerate(keys):
+        mapping.append((key, lambda n=n: titles()[n]))
+
 def add_common_mapping(old_filename, guess, mapping):
 
     # Original dir name, file name and extension
     original_dirname = os.path.basename(download_dir)
     original_fname, original_fext = os.path.splitext(os.path.split(os.path.basename(old_filename))[1])
-    original_category = os.environ.get('NZBPP_CATEGORY', '')
+    original_category = category
 
     # Directory name
     title_name = original_dirname.replace("-", " ").replace('.',' ').replace('_',' ')
-    fname_tname, fname_tname_two, fname_tname_three = get_titles(title_name, True)
-    fname_name, fname_name_two, fname_name_three = get_titles(title_name, False)
     mapping.append(('%dn', original_dirname))
-    mapping.append(('%^dn', fname_tname))
-    mapping.append(('%.dn', fname_tname_two))
-    mapping.append(('%_dn', fname_tname_three))
-    mapping.append(('%^dN', fname_name))
-    mapping.append(('%.dN', fname_name_two))
-    mapping.append(('%_dN', fname_name_three))
+    add_titles_mapping(mapping, title_name, True, ('%^dn', '%.dn', '%_dn'))
+    add_titles_mapping(mapping, title_name, False, ('%^dN', '%.dN', '%_dN'))
 
     # File name
     title_name = original_fname.replace("-", " ").replace('.',' ').replace('_',' ')
-    fname_tname, fname_tname_two, fname_tname_three = get_titles(title_name, True)
-    fname_name, fname_name_two, fname_name_three = get_titles(title_name, False)
     mapping.append(('%fn', original_fname))
-    mapping.append(('%^fn', fname_tname))
-    mapping.append(('%.fn', fname_tname_two))
-    mapping.append(('%_fn', fname_tname_three))
-    mapping.append(('%^fN', fname_name))
-    mapping.append(('%.fN', fname_name_two))
-    mapping.append(('%_fN', fname_name_three))
+    add_titles_mapping(mapping, title_name, True, ('%^fn', '%.fn', '%_fn'))
+    add_titles_mapping(mapping, title_name, False, ('%^fN', '%.fN', '%_fN'))
 
     # File extension
     mapping.append(('%ext', original_fext))
@@ -781,14 +1656,8 @@ def add_common_mapping(old_filename, guess, mapping):
     mapping.append(('%Ext', original_fext.title()))
 
     # Category
-    category_tname, category_tname_two, category_tname_three = get_titles(original_category, True)
-    category_name, category_name_two, category_name_three = get_titles(original_category, False)
-    mapping.append(('%cat', category_tname))
-    mapping.append(('%.cat', category_tname_two))
-    mapping.append(('%_cat', category_tname_three))
-    mapping.append(('%cAt', category_name))
-    mapping.append(('%.cAt', category_name_two))
-    mapping.append(('%_cAt', category_name_three))
+    add_titles_mapping(mapping, original_category, True, ('%cat', '%.cat', '%_cat'))
+    add_titles_mapping(mapping, original_category, False, ('%cAt', '%.cAt', '%_cAt'))
 
     # Video information
     mapping.append(('%qf', guess.get('format', '')))
@@ -802,14 +1671,8 @@ def add_series_mapping(guess, mapping):
 
     # Show name
     series = guess.get('title', '')
-    show_tname, show_tname_two, show_tname_three = get_titles(series, True)
-    show_name, show_name_two, show_name_three = get_titles(series, False)
-    mapping.append(('%sn', show_tname))
-    mapping.append(('%s.n', show_tname_two))
-    mapping.append(('%s_n', show_tname_three))
-    mapping.append(('%sN', show_name))
-    mapping.append(('%s.N', show_name_two))
-    mapping.append(('%s_N', show_name_three))
+    add_titles_mapping(mapping, series, True, ('%sn', '%s.n', '%s_n'))
+    add_titles_mapping(mapping, series, False, ('%sN', '%s.N', '%s_N'))
 
     # season number
     season_num = str(guess.get('season', ''))
@@ -817,23 +1680,9 @@ def add_series_mapping(guess, mapping):
     mapping.append(('%0s', season_num.rjust(2,'0')))
 
     # episode names
-    title = guess.get('episode_title')
-    if title:
-        ep_tname, ep_tname_two, ep_tname_three = get_titles(title, True)
-        ep_name, ep_name_two, ep_name_three = get_titles(title, False)
-        mapping.append(('%en', ep_tname))
-        mapping.append(('%e.n', ep_tname_two))
-        mapping.append(('%e_n', ep_tname_three))
-        mapping.append(('%eN', ep_name))
-        mapping.append(('%e.N', ep_name_two))
-        mapping.append(('%e_N', ep_name_three))
-    else:
-        mapping.append(('%en', ''))
-        mapping.append(('%e.n', ''))
-        mapping.append(('%e_n', ''))
-        mapping.append(('%eN', ''))
-        mapping.append(('%e.N', ''))
-        mapping.append(('%e_N', ''))
+    title = guess.get('episode_title') or ''
+    add_titles_mapping(mapping, title, True, ('%en', '%e.n', '%e_n'))
+    add_titles_mapping(mapping, title, False, ('%eN', '%e.N', '%e_N'))
 
     # episode number
     if not isinstance(guess.get('episode'), list):
@@ -871,20 +1720,11 @@ def add_movies_mapping(guess, mapping):
 
     # title
     name = guess.get('title', '')
-    ttitle, ttitle_two, ttitle_three = get_titles(name, True)
-    title, title_two, title_three = get_titles(name, False)
-    mapping.append(('%title', ttitle))
-    mapping.append(('%.title', ttitle_two))
-    mapping.append(('%_title', ttitle_three))
+    add_titles_mapping(mapping, name, True, ('%title', '%.title', '%_title'))
 
     # title (short forms)
-    mapping.append(('%t', ttitle))
-    mapping.append(('%.t', ttitle_two))
-    mapping.append(('%_t', ttitle_three))
-
-    mapping.append(('%tT', title))
-    mapping.append(('%t.T', title_two))
-    mapping.append(('%t_T', title_three))
+    add_titles_mapping(mapping, name, True, ('%t', '%.t', '%_t'))
+    add_titles_mapping(mapping, name, False, ('%tT', '%t.T', '%t_T'))
 
     # year
     year = str(guess.get('year', ''))
@@ -903,49 +1743,26 @@ def add_dated_mapping(guess, mapping):
 
     # title
     name = guess.get('title', '')
-    ttitle, ttitle_two, ttitle_three = get_titles(name, True)
-    title, title_two, title_three = get_titles(name, True)
-    mapping.append(('%title', title))
-    mapping.append(('%.title', title_two))
-    mapping.append(('%_title', title_three))
+    add_titles_mapping(mapping, name, True, ('%title', '%.title', '%_title'))
 
     # title (short forms)
-    mapping.append(('%t', title, 'consider using %sn'))
-    mapping.append(('%.t', title_two, 'consider using %s.n'))
-    mapping.append(('%_t', title_three, 'consider using %s_n'))
+    titles = cached_titles(name, True)
+    mapping.append(('%t', lambda: titles()[0], 'consider using %sn'))
+    mapping.append(('%.t', lambda: titles()[1], 'consider using %s.n'))
+    mapping.append(('%_t', lambda: titles()[2], 'consider using %s_n'))
 
     # Show name
     series = guess.get('title', '')
-    show_tname, show_tname_two, show_tname_three = get_titles(series, True)
-    show_name, show_name_two, show_name_three = get_titles(series, False)
-    mapping.append(('%sn', show_tname))
-    mapping.append(('%s.n', show_tname_two))
-    mapping.append(('%s_n', show_tname_three))
-    mapping.append(('%sN', show_name))
-    mapping.append(('%s.N', show_name_two))
-    mapping.append(('%s_N', show_name_three))
+    add_titles_mapping(mapping, series, True, ('%sn', '%s.n', '%s_n'))
+    add_titles_mapping(mapping, series, False, ('%sN', '%s.N', '%s_N'))
 
     # Some older code at this point stated:
     # "Guessit doesn't provide episode names for dated tv shows"
     # but was referring to the invalid field '%desc'
     # In my researches I couldn't find such a case, but just to be sure
-    ep_title = guess.get('episode_title')
-    if ep_title:
-        ep_tname, ep_tname_two, ep_tname_three = get_titles(ep_title, True)
-        ep_name, ep_name_two, ep_name_three = get_titles(ep_title, False)
-        mapping.append(('%en', ep_tname))
-        mapping.append(('%e.n', ep_tname_two))
-        mapping.append(('%e_n', ep_tname_three))
-        mapping.append(('%eN', ep_name))
-        mapping.append(('%e.N', ep_name_two))
-        mapping.append(('%e_N', ep_name_three))
-    else:
-        mapping.append(('%en', ''))
-        mapping.append(('%e.n', ''))
-        mapping.append(('%e_n', ''))
-        mapping.append(('%eN', ''))
-        mapping.append(('%e.N', ''))
-        mapping.append(('%e_N', ''))
+    ep_title = guess.get('episode_title') or ''
+    add_titles_mapping(mapping, ep_title, True, ('%en', '%e.n', '%e_n'))
+    add_titles_mapping(mapping, ep_title, False, ('%eN', '%e.N', '%e_N'))
 
     # date
     date = guess.get('date')
@@ -1070,9 +1887,167 @@ def apply_dnzb_headers(guess):
     if verbose and dnzb_used:
         print(guess)
 
-def guess_info(filename):
-    """ Parses the filename using guessit-library """
+# Guess cache.
+#
+# Results of guessit are kept in an SQLite database (option <GuessCache>)
+# keyed by the guessed name, the options and the versions of guessit and
+# rebulk. Values which aren't plain json (languages, countries, dates and
+# quantities) are stored as single-key objects like {"$date": "2017-01-31"}.
+
+# Open guess cache of this process (see "open_guess_cache")
+guess_cache = None
+
+# Number of stores after which the guess cache is trimmed to its size
+GUESS_CACHE_TRIM_INTERVAL = 1000
+
+def library_version(name):
+    """ Returns version of a bundled library without importing it """
+    with open(os.path.join(dirname(__file__), 'lib', name, '__version__.py')) as file:
+        return re.search(r"__version__ = '([^']*)'", file.read()).group(1)
+
+def encode_guess_value(value):
+    """ Converts value of a guessit property to json compatible value.
+        Raises TypeError for values of unknown types.
+    """
+    if value is None or isinstance(value, (bool, float) + six.integer_types + six.string_types):
+        return value
+    elif isinstance(value, list):
+        return [encode_guess_value(item) for item in value]
+    elif isinstance(value, datetime.datetime):
+        return {'$datetime': value.strftime('%Y-%m-%dT%H:%M:%S.%f')}
+    elif isinstance(value, datetime.date):
+        return {'$date': value.strftime('%Y-%m-%d')}
+    type_name = type(value).__name__
+    if type_name == 'Language':
+        return {'$language': [value.alpha3, value.country and value.country.alpha2, value.script and value.script.code]}
+    elif type_name == 'Country':
+        return {'$country': value.alpha2}
+    elif type_name in ('Size', 'BitRate', 'FrameRate'):
+        return {'$' + type_name: [value.magnitude, value.units]}
+    raise TypeError('Can not cache %s' % type_name)
+
+def decode_guess_value(value):
+    """ Converts value encoded by "encode_guess_value" back """
+    if isinstance(value, list):
+        return [decode_guess_value(item) for item in value]
+    elif not isinstance(value, dict):
+        return value
+    (type_name, value), = value.items()
+    if type_name == '$datetime':
+        return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+    elif type_name == '$date':
+        return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+    elif type_name == '$language':
+        import babelfish
+        return babelfish.Language(*value)
+    elif type_name == '$country':
+        import babelfish
+        return babelfish.Country(value)
+    from guessit.rules.common import quantity
+    return getattr(quantity, type_name[1:])(*value)
+
+class guess_cache_db:
+    """Guessit results stored in an SQLite database, the least recently used
+       names are removed when the cache grows beyond its size.
+    """
+
+    def __init__(self, path, size):
+        import sqlite3
+        self.error = sqlite3.Error
+        self.path = path
+        self.size = size
+        self.pid = os.getpid()
+        self.stores = 0
+        self.version = 'guessit %s, rebulk %s' % (library_version('guessit'), library_version('rebulk'))
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS guesses (name TEXT, options TEXT, version TEXT, '
+            'result TEXT, used REAL, PRIMARY KEY (name, options, version))')
+        self.db.execute('CREATE INDEX IF NOT EXISTS guesses_used ON guesses (used)')
+        self.trim()
+
+    def key(self, name, options):
+        options = hashlib.sha1(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()
+        return (name, options, self.version)
+
+    def get(self, name, options):
+        """ Returns cached result (OrderedDict) or None """
+        key = self.key(name, options)
+        row = self.db.execute('SELECT result FROM guesses WHERE name = ? AND options = ? AND version = ?',
+            key).fetchone()
+        if row is None:
+            return None
+        self.db.execute('UPDATE guesses SET used = ? WHERE name = ? AND options = ? AND version = ?',
+            (time.time(),) + key)
+        result = json.loads(row[0], object_pairs_hook=OrderedDict)
+        return OrderedDict((name, decode_guess_value(value)) for name, value in result.items())
+
+    def put(self, name, options, guess):
+        try:
+            result = json.dumps(OrderedDict((name, encode_guess_value(value)) for name, value in guess.items()))
+        except TypeError:
+            return
+        self.db.execute('INSERT OR REPLACE INTO guesses VALUES (?, ?, ?, ?, ?)',
+            self.key(name, options) + (result, time.time()))
+        self.stores += 1
+        if self.stores % GUESS_CACHE_TRIM_INTERVAL == 0:
+            self.trim()
+
+    def trim(self):
+        count = self.db.execute('SELECT COUNT(*) FROM guesses').fetchone()[0]
+        if count > self.size:
+            self.db.execute('DELETE FROM guesses WHERE rowid IN '
+                '(SELECT rowid FROM guesses ORDER BY used LIMIT ?)', (count - self.size,))
+
+def open_guess_cache():
+    """ Returns guess cache of this process or None if it's disabled """
+    global guess_cache, guess_cache_path
+    if not guess_cache_path:
+        return None
+    if guess_cache is None or guess_cache.pid != os.getpid() or guess_cache.path != guess_cache_path:
+        # Worker processes and daemon jobs with other options open their own
+        try:
+            guess_cache = guess_cache_db(guess_cache_path, guess_cache_size)
+        except Exception as e:
+            print('[WARNING] Could not open guess cache %s: %s' % (guess_cache_path, e))
+            # Not used for the rest of the run
+            guess_cache_path = ''
+            guess_cache = None
+    return guess_cache
+
+def cached_guessit(name, options=None):
+    """ Guesses name with guessit, the result is taken from the guess cache
+        (option <GuessCache>) if it's there
+    """
+    cache = open_guess_cache()
+    if cache is not None:
+        try:
+            guess = cache.get(name, options)
+        except cache.error as e:
+            print('[WARNING] Could not read guess cache: %s' % e)
+            guess = None
+        if guess is not None:
+            metrics.count('guess_cache_hits')
+            return guess
+
+    load_guessit()
+    if guessit.api.default_api.rebulk is None:
+        configure_guessit(guessit.api.default_api)
+    metrics.count('guessit_calls')
+    guess = guessit.api.guessit(name, options)
+
+    if cache is not None:
+        try:
+            cache.put(name, options, guess)
+        except cache.error as e:
+            print('[WARNING] Could not write guess cache: %s' % e)
+    return guess
 
+def guess_info(filename, excludes=[]):
+    """ Parses the filename using guessit-library.
+        Properties listed in 'excludes' are not guessed.
+    """
     if use_nzb_name:
         if verbose:
             print("Using NZB-Name")
@@ -1089,7 +2064,7 @@ def guess_info(filename):
     if verbose:
         print('Guessing: %s' % guessfilename)
 
-    guess = guessit.api.guessit(six.text_type(guessfilename), {'allowed_languages': [], 'allowed_countries': []})
+    guess = cached_guessit(six.text_type(guessfilename), {'allowed_languages': [], 'allowed_countries': [], 'excludes': excludes})
 
     if verbose:
         print(guess)
@@ -1160,85 +2135,148 @@ def guess_info(filename):
 
     return guess
 
+# Supported video types
+VIDEO_TYPES = ('movie', 'series', 'dated', 'othertv')
+
+# Elements whose values don't depend on information guessed from file names
+FILESYSTEM_ELEMENTS = frozenset(('%dn', '%^dn', '%.dn', '%_dn', '%^dN', '%.dN', '%_dN',
+    '%fn', '%^fn', '%.fn', '%_fn', '%^fN', '%.fN', '%_fN', '%ext', '%EXT', '%Ext',
+    '%cat', '%.cat', '%_cat', '%cAt', '%.cAt', '%_cAt'))
+
+# Properties not affecting video type. They are not guessed if the sort strings
+# use only elements from FILESYSTEM_ELEMENTS.
+TYPE_INDEPENDENT_PROPERTIES = ['website', 'language', 'subtitle_language', 'country',
+    'streaming_service', 'edition', 'episode_title', 'mimetype']
+
+def type_options(vtype):
+    """ Returns destination directory and sort string for video type """
+    if vtype == 'movie':
+        return movies_dir, movies_format
+    elif vtype == 'series':
+        return series_dir, series_format
+    elif vtype == 'dated':
+        return dated_dir, dated_format
+    else:
+        return othertv_dir, othertv_format
+
+def add_type_mapping(vtype, guess, mapping):
+    """ Adds elements specific to video type """
+    if vtype == 'series':
+        add_series_mapping(guess, mapping)
+    elif vtype == 'dated':
+        add_dated_mapping(guess, mapping)
+    else:
+        add_movies_mapping(guess, mapping)
+
+def sort_string(format):
+    """ Prepares sort string from formatting option """
+    # Add extension specifier if the format string doesn't end with it
+    if format.rstrip('}')[-5:] != '.%ext':
+        format += '.%ext'
+
+    return format.replace('\\', '/')
+
+def analyze_formats():
+    """ Finds out which information must be guessed from file names:
+        'full' - the sort strings use guessed properties;
+        'type' - only video type, which selects destination and sort string;
+        'none' - nothing, all video types are sorted the same way.
+    """
+    global guess_level
+
+    # Only names of elements are needed, not their values
+    guess = {'date': datetime.date(2000, 1, 1)}
+    destinations = set()
+    guess_level = 'none'
+    for vtype in VIDEO_TYPES:
+        dest_dir, format = type_options(vtype)
+        destinations.add((dest_dir, format))
+        mapping = []
+        add_common_mapping('', guess, mapping)
+        add_type_mapping(vtype, guess, mapping)
+        for text, key in compile_format(sort_string(format), mapping):
+            if key is not None and key not in FILESYSTEM_ELEMENTS:
+                guess_level = 'full'
+
+    if guess_level == 'none' and len(destinations) > 1:
+        guess_level = 'type'
+
+    if verbose:
+        print('Guessing from file names: %s' % guess_level)
+
 def construct_path(filename):
-    """ Parses the filename and generates new name for renaming """
+    """ Parses the filename and generates new name for renaming.
+        The guessed video type is stored in global 'video_type'.
+    """
+    global video_type
 
     if verbose:
         print("filename: %s" % filename)
 
-    guess = guess_info(filename)
+    with metrics.phase('guess', filename):
+        if guess_level == 'none':
+            # All video types are sorted the same way
+            guess = {'vtype': VIDEO_TYPES[0]}
+        elif guess_level == 'type':
+            guess = guess_info(filename, TYPE_INDEPENDENT_PROPERTIES)
+        else:
+            guess = guess_info(filename)
     type = guess.get('vtype')
-    mapping = []
-    add_common_mapping(filename, guess, mapping)
-
-    if type == 'movie':
-        dest_dir = movies_dir
-        format = movies_format
-        add_movies_mapping(guess, mapping)
-    elif type == 'series':
-        dest_dir = series_dir
-        format = series_format
-        add_series_mapping(guess, mapping)
-    elif type == 'dated':
-        dest_dir = dated_dir
-        format = dated_format
-        add_dated_mapping(guess, mapping)
-    elif type == 'othertv':
-        dest_dir = othertv_dir
-        format = othertv_format
-        add_movies_mapping(guess, mapping)
-    else:
+    video_type = type
+    if type not in VIDEO_TYPES:
         if verbose:
             print('Could not determine video type for %s' % filename)
         return None
 
-    if dest_dir == '':
-        dest_dir = os.path.dirname(download_dir)
+    with metrics.phase('format', filename):
+        dest_dir, format = type_options(type)
+        mapping = []
+        add_common_mapping(filename, guess, mapping)
+        add_type_mapping(type, guess, mapping)
 
-    # Find out a char most suitable as dupe_separator
-    guess_dupe_separator(format)
+        if dest_dir == '':
+            dest_dir = os.path.dirname(download_dir)
 
-    # Add extension specifier if the format string doesn't end with it
-    if format.rstrip('}')[-5:] != '.%ext':
-        format += '.%ext'
+        # Find out a char most suitable as dupe_separator
+        guess_dupe_separator(format)
 
-    sorter = format.replace('\\', '/')
+        sorter = sort_string(format)
 
-    if verbose:
-        print('format: %s' % sorter)
+        if verbose:
+            print('format: %s' % sorter)
 
-    # Replace elements
-    path = path_subst(sorter, mapping)
+        # Replace elements
+        path = path_subst(sorter, mapping, type)
 
-    if verbose:
-        print('path after subst: %s' % path)
+        if verbose:
+            print('path after subst: %s' % path)
 
-    # Cleanup file name
-    old_path = ''
-    while old_path != path:
-        old_path = path
-        for key, name in six.iteritems(REPLACE_AFTER):
-            path = path.replace(key, name)
+        # Cleanup file name
+        old_path = ''
+        while old_path != path:
+            old_path = path
+            for key, name in six.iteritems(REPLACE_AFTER):
+                path = path.replace(key, name)
 
-    path = path.replace('%up', '..')
+        path = path.replace('%up', '..')
 
-    # Uppercase all characters encased in {{}}
-    path = to_uppercase(path)
+        # Uppercase all characters encased in {{}}
+        path = to_uppercase(path)
 
-    # Lowercase all characters encased in {}
-    path = to_lowercase(path)
+        # Lowercase all characters encased in {}
+        path = to_lowercase(path)
 
-    # Strip any extra strippable characters around foldernames and filename
-    path, ext = os.path.splitext(path)
-    path = strip_folders(path)
-    path = path + ext
+        # Strip any extra strippable characters around foldernames and filename
+        path, ext = os.path.splitext(path)
+        path = strip_folders(path)
+        path = path + ext
 
-    path = os.path.normpath(path)
+        path = os.path.normpath(path)
 
-    if verbose:
-        print('path after cleanup: %s' % path)
+        if verbose:
+            print('path after cleanup: %s' % path)
 
-    new_path = os.path.join(dest_dir, path)
+        new_path = os.path.join(dest_dir, path)
 
     if verbose:
         print('destination path: %s' % new_path)
@@ -1250,83 +2288,946 @@ def construct_path(filename):
 
     return new_path
 
-# Flag indicating that anything was moved. Cleanup possible.
-files_moved = False
+def load_guessit():
+    """ Imports guessit library (if not yet imported) """
+    global guessit
+    if guessit is None:
+        with metrics.phase('import'):
+            import guessit
+
+# Rules snapshot.
+#
+# Most of the time of building the rules of guessit is spent on compiling
+# regular expressions. While rules are built "re.compile" is replaced so
+# that the programs of the regular expression engine (the result of
+# parsing and compiling, the arguments of "_sre.compile") are taken from
+# the snapshot file (option <RulesSnapshot>), stored with marshal. They
+# depend on the version of Python, the snapshot is rebuilt when it or
+# the version of guessit or rebulk changes.
+
+# Regular expression programs by (pattern, flags), None until the snapshot is loaded
+regex_programs = None
+
+def rules_snapshot_path():
+    """ Returns path of the rules snapshot of this version of Python """
+    path = os.environ.get('NZBPO_RULESSNAPSHOT', '') or \
+        os.path.join(os.environ.get('NZBOP_TEMPDIR', '') or tempfile.gettempdir(), RULES_SNAPSHOT)
+    base, ext = os.path.splitext(path)
+    return '%s.py%i%i%s' % (base, sys.version_info[0], sys.version_info[1], ext)
+
+def rules_snapshot_version():
+    return '%s %s, guessit %s, rebulk %s' % (sys.version, sys.platform,
+        library_version('guessit'), library_version('rebulk'))
+
+def load_rules_snapshot():
+    """ Returns dict of regular expression programs of the snapshot """
+    try:
+        with open(rules_snapshot_path(), 'rb') as file:
+            version, programs = marshal.load(file)
+        if version == rules_snapshot_version():
+            return dict(((program[0], program[1]), program) for program in programs)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        pass
+    return {}
+
+def save_rules_snapshot():
+    """ Writes the regular expression programs to the snapshot (atomically) """
+    path = rules_snapshot_path()
+    temp = '%s.%i.tmp' % (path, os.getpid())
+    try:
+        with open(temp, 'wb') as file:
+            marshal.dump((rules_snapshot_version(), list(regex_programs.values())), file)
+        os.rename(temp, path)
+    except (IOError, OSError, ValueError, TypeError) as e:
+        print('[DETAIL] Could not save rules snapshot: %s' % e)
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+
+def regex_program(pattern, flags):
+    """ Parses and compiles regular expression like "sre_compile.compile".
+        Returns list of arguments for "_sre.compile".
+    """
+    try:
+        from re import _parser as sre_parse, _compiler as sre_compile
+    except ImportError:
+        import sre_parse, sre_compile
+    parsed = sre_parse.parse(pattern, flags)
+    # Opcodes are named int constants since Python 3.6, marshal only takes plain ints
+    code = [int(op) for op in sre_compile._code(parsed, flags)]
+    state = getattr(parsed, 'state', None) or parsed.pattern
+    indexgroup = [None] * state.groups
+    for name, index in state.groupdict.items():
+        indexgroup[index] = name
+    return [pattern, flags | state.flags, code, state.groups - 1, dict(state.groupdict), indexgroup]
+
+@contextlib.contextmanager
+def regex_snapshot():
+    """ Takes regular expressions compiled by "re.compile" in the block from
+        the rules snapshot, new ones are added to the snapshot
+    """
+    global regex_programs
+    from rebulk import remodule
+    import re as stdlib_re
+    import _sre
+    if remodule.REGEX_AVAILABLE or hasattr(sys, 'pypy_version_info'):
+        # Programs are specific to the regular expression engine of CPython
+        yield
+        return
+    if regex_programs is None:
+        regex_programs = load_rules_snapshot()
+    sre_compile = stdlib_re.compile
+    new_programs = []
+    # The index group is a tuple since Python 3.7
+    index_type = tuple if sys.version_info >= (3, 7) else list
+
+    def compile(pattern, flags=0):
+        if not isinstance(pattern, six.string_types) or flags & stdlib_re.DEBUG:
+            return sre_compile(pattern, flags)
+        key = (pattern, int(flags))
+        program = regex_programs.get(key)
+        if program is None:
+            try:
+                program = regex_program(pattern, int(flags))
+            except Exception:
+                # Let "re" report the error
+                return sre_compile(pattern, flags)
+            regex_programs[key] = program
+            new_programs.append(key)
+        pattern, flags, code, groups, groupindex, indexgroup = program
+        try:
+            return _sre.compile(pattern, flags, code, groups, groupindex, index_type(indexgroup))
+        except (ValueError, TypeError, RuntimeError):
+            # Program doesn't fit this engine, compile as usual
+            del regex_programs[key]
+            return sre_compile(*key)
+
+    stdlib_re.compile = compile
+    try:
+        yield
+    finally:
+        stdlib_re.compile = sre_compile
+    if new_programs:
+        save_rules_snapshot()
+
+def configure_guessit(api, **options):
+    """ Builds the rules of guessit api, regular expressions are taken from
+        the rules snapshot
+    """
+    with metrics.phase('configure'):
+        with regex_snapshot():
+            api.configure(**options)
+
+def subtitle_rules(config):
+    """ Builds rebulk object with only the rules of guessit needed to detect
+        subtitle language (language and country words next to the extension)
+    """
+    from rebulk import Rebulk
+    from guessit.rules.markers.path import path
+    from guessit.rules.markers.groups import groups
+    from guessit.rules.properties.container import container
+    from guessit.rules.properties.language import language
+    from guessit.rules.properties.country import country
+
+    def _config(name):
+        return config.get(name, {})
+
+    common_words = frozenset(_config('common_words'))
+
+    rebulk = Rebulk()
+    rebulk.rebulk(path(_config('path')))
+    rebulk.rebulk(groups(_config('groups')))
+    rebulk.rebulk(container(_config('container')))
+    rebulk.rebulk(language(_config('language'), common_words))
+    rebulk.rebulk(country(_config('country'), common_words))
+    return rebulk
+
+def guess_subtitle_language(filename):
+    """ Returns subtitle language (or None) of a subtitle file. Only the last
+        part of the name (such as '.eng', '.pt-BR') and the extension are parsed,
+        results are cached per suffix. A language in a part with a dash may as
+        well be a release group ('.XviD-DEU'), then the whole name is parsed.
+    """
+    global subtitle_api
+    fbase, fext = os.path.splitext(filename)
+    part = fbase[fbase.rfind('.') + 1:]
+    suffix = part + fext
+    if suffix not in subtitle_languages:
+        if subtitle_api is None:
+            load_guessit()
+            subtitle_api = guessit.api.GuessItApi()
+            configure_guessit(subtitle_api, rules_builder=subtitle_rules)
+        metrics.count('guessit_calls')
+        lang = subtitle_api.guessit(suffix).get('subtitle_language')
+        if isinstance(lang, list):
+            lang = lang[0]
+        subtitle_languages[suffix] = lang
+    lang = subtitle_languages[suffix]
+    if lang is not None and '-' in part:
+        lang = cached_guessit(filename).get('subtitle_language')
+        if isinstance(lang, list):
+            lang = lang[0]
+    return lang
+
+def find_video_files(directory):
+    """ Returns list of video files in directory and its subdirectories
+        (from the inventory) and a flag indicating errors.
+    """
+    video_files = []
+    errors = False
+
+    for old_path, size, kind in inventory.files(directory):
+        old_filename = os.path.basename(old_path)
+
+        # Check extension
+        if kind != 'video': continue
 
-# Flag indicating any error. Cleanup is disabled.
-errors = False
+        if size is None:
+            errors = True
+            print('[ERROR] Failed: %s' % old_filename)
+            print('[ERROR] Could not read size of %s' % old_path)
+            continue
 
-# Process all the files in download_dir and its subdirectories
-video_files = []
+        # Check minimum file size
+        if size < min_size:
+            print('[INFO] Skipping small: %s' % old_filename)
+            continue
 
-for root, dirs, files in os.walk(download_dir):
-    for old_filename in files:
+        # This is our video file, we should process it
+        video_files.append(old_path)
+
+    return video_files, errors
+
+class captured_output:
+    """File-like object collecting everything written into it"""
+
+    def __init__(self):
+        self.data = []
+
+    def write(self, data):
+        if six.PY2 and isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        self.data.append(data)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return ''.join(self.data)
+
+def fork_workers():
+    """ Returns True if worker processes are forked (and inherit guessit
+        imported and configured by the parent)
+    """
+    if hasattr(multiprocessing, 'get_start_method'):
+        return multiprocessing.get_start_method() == 'fork'
+    # Python 2 forks on posix platforms
+    return os.name == 'posix'
+
+def init_worker():
+    """ Prepares worker process for guessing """
+    # Workers started without fork() begin with a fresh interpreter
+    if not fork_workers():
+        saved_stdout = sys.stdout
+        sys.stdout = captured_output()
         try:
-            old_path = os.path.join(root, old_filename)
+            load_options()
+        finally:
+            sys.stdout = saved_stdout
+        load_guessit()
+
+def construct_path_task(task):
+    """ Constructs new path for a video file in a worker process.
+        Returns new path, dupe separator, video type, output, error flag
+        and metrics.
+    """
+    global download_dir, use_nzb_name, video_type, metrics
+    old_path, download_dir, use_nzb_name = task
+    metrics = run_metrics()
+    new_path = None
+    video_type = None
+    failed = False
+    output = captured_output()
+    saved_stdout, saved_stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = output
+    try:
+        try:
+            new_path = construct_path(old_path)
+        except Exception as e:
+            failed = True
+            print('[ERROR] Failed: %s' % old_path)
+            print('[ERROR] %s' % e)
+            traceback.print_exc()
+    finally:
+        sys.stdout, sys.stderr = saved_stdout, saved_stderr
+    return new_path, dupe_separator, video_type, output.getvalue(), failed, metrics
+
+def construct_paths(tasks):
+    """ Constructs new paths for video files, in parallel if option
+        <GuessProcesses> allows. A task is a tuple of video file path,
+        download directory and flag "use_nzb_name".
+        Yields task, new path, dupe separator, video type and error flag in
+        order of tasks.
+    """
+    global download_dir, use_nzb_name, video_type
+
+    if guess_processes > 1 and len(tasks) > 1:
+        if fork_workers():
+            # Import and configure guessit once, forked workers inherit it
+            load_guessit()
+            if guessit.api.default_api.rebulk is None:
+                configure_guessit(guessit.api.default_api)
+        pool = multiprocessing.Pool(min(guess_processes, len(tasks)), init_worker)
+        try:
+            results = pool.imap(construct_path_task, tasks)
+            for task in tasks:
+                new_path, separator, vtype, output, failed, worker_metrics = next(results)
+                sys.stdout.write(output)
+                metrics.merge(worker_metrics)
+                yield task, new_path, separator, vtype, failed
+        finally:
+            pool.terminate()
+            pool.join()
+        return
+
+    for task in tasks:
+        old_path, download_dir, use_nzb_name = task
+        new_path = None
+        video_type = None
+        failed = False
+        try:
+            new_path = construct_path(old_path)
+        except Exception as e:
+            failed = True
+            print('[ERROR] Failed: %s' % old_path)
+            print('[ERROR] %s' % e)
+            traceback.print_exc()
+        yield task, new_path, dupe_separator, video_type, failed
 
-            # Check extension
-            ext = os.path.splitext(old_filename)[1].lower()
-            if ext not in video_extensions: continue
+def sort_download():
+    """ Sorts video files of the download described by environment variables.
+        Returns exit code for NZBGet.
+    """
+    global use_nzb_name, dupe_separator, inventory, satellite_indexes
 
-            # Check minimum file size
-            if os.path.getsize(old_path) < min_size:
-                print('[INFO] Skipping small: %s' % old_filename)
-                continue
+    exit_code = load_options()
+    if exit_code is not None:
+        return exit_code
+
+    # Flag indicating that anything was moved. Cleanup possible.
+    files_moved = False
+
+    # Process all the files in download_dir and its subdirectories
+    with metrics.phase('inventory'):
+        inventory = file_inventory(download_dir)
+    satellite_indexes = {}
+
+    # Flag indicating any error. Cleanup is disabled.
+    video_files, errors = find_video_files(download_dir)
+
+    use_nzb_name = prefer_nzb_name and len(video_files) == 1
+
+    tasks = [(old_path, download_dir, use_nzb_name) for old_path in video_files]
+    results = list(construct_paths(tasks))
+
+    # Create destination directories before moving
+    if not preview:
+        make_dirs([os.path.dirname(new_path) for task, new_path, separator, vtype, failed in results if new_path])
 
-            # This is our video file, we should process it
-            video_files.append(old_path)
+    for task, new_path, separator, vtype, failed in results:
+        old_path = task[0]
+        if failed:
+            errors = True
+            continue
+        dupe_separator = separator
+        try:
+            # Move video file
+            if new_path:
+                with metrics.phase('move', old_path):
+                    new_path = rename(old_path, new_path)
+                add_plan_record(old_path, new_path, 'video', 'guessed as %s' % vtype)
+                files_moved = True
+
+                # Move satellite files
+                if satellites:
+                    with metrics.phase('satellites', old_path):
+                        move_satellites(old_path, new_path)
 
         except Exception as e:
             errors = True
-            print('[ERROR] Failed: %s' % old_filename)
+            print('[ERROR] Failed: %s' % old_path)
             print('[ERROR] %s' % e)
             traceback.print_exc()
 
-use_nzb_name = prefer_nzb_name and len(video_files) == 1
+    # Inform NZBGet about new destination path
+    finaldir = '|'.join(moved_files.destination_dirs())
+
+    if finaldir != '':
+        print('[NZB] FINALDIR=%s' % finaldir)
+
+    # Cleanup if:
+    # 1) files were moved AND
+    # 2) no errors happen AND
+    # 3) all remaining files are smaller than <MinSize>
+    if cleanup and files_moved and not errors:
+        with metrics.phase('cleanup'):
+            cleanup_download_dir()
+
+    # Returing status to NZBGet
+    if errors:
+        return report_metrics(POSTPROCESS_ERROR)
+    elif files_moved:
+        return report_metrics(POSTPROCESS_SUCCESS)
+    else:
+        return report_metrics(POSTPROCESS_NONE)
+
+# Library re-sort.
+#
+# "VideoSort.py --resort <dir>" sorts all video files found in a directory
+# tree in one run, using the same rules as when sorting downloads. Each
+# subdirectory of the root directory is treated as a separate download;
+# a video file located directly in the root directory is treated as a
+# download of its own. Script options are taken from the environment
+# ("NZBPO_<OPTION>"), from command line ("--option <Option>=<value>") or
+# have their default values from the options section of the script.
+
+# Interval of progress messages during library re-sort (seconds)
+PROGRESS_INTERVAL = 5
+
+def load_default_options():
+    """ Sets options missing in the environment to their defaults from
+        the options section of the script.
+    """
+    in_options = False
+    for line in open(__file__):
+        if line.startswith('### OPTIONS'):
+            in_options = True
+        elif line.startswith('### NZBGET POST-PROCESSING SCRIPT') and in_options:
+            break
+        elif in_options:
+            m = re.match(r'^#(\w+)=(.*)$', line.rstrip())
+            if m:
+                # Values referring to NZBGet options (${DestDir}) can't be resolved
+                value = m.group(2) if m.group(2).find('${') == -1 else ''
+                os.environ.setdefault('NZBPO_' + m.group(1).upper(), value)
+
+def select_download(dir, video_count):
+    """ Makes video files of download directory 'dir' the subject of sorting """
+    global download_dir, nzb_name, use_nzb_name
+    download_dir = dir
+    nzb_name = os.path.basename(dir)
+    use_nzb_name = prefer_nzb_name and video_count == 1
+
+def report_progress(action, done, total, start_time, last_time):
+    """ Prints progress message if the last one is older than PROGRESS_INTERVAL.
+        Returns time of the last message.
+    """
+    now = time.time()
+    if now - last_time < PROGRESS_INTERVAL and done < total:
+        return last_time
+    elapsed = now - start_time
+    print('[INFO] %s %i of %i files (%.1f files/s)' % (action, done, total, done / elapsed if elapsed > 0 else 0))
+    sys.stdout.flush()
+    return now
+
+def resort_library(root_dir, options):
+    """ Sorts all video files in directory tree 'root_dir'.
+        Returns exit code.
+    """
+    global dupe_separator, inventory, satellite_indexes
+
+    root_dir = os.path.abspath(root_dir)
+    for name, value in options:
+        os.environ['NZBPO_' + name.upper()] = value
+    os.environ['NZBPP_DIRECTORY'] = root_dir
+    os.environ['NZBPP_NZBNAME'] = os.path.basename(root_dir)
+    os.environ['NZBPP_PARSTATUS'] = '0'
+    os.environ['NZBPP_UNPACKSTATUS'] = '0'
+    # Files remaining in library directories are usually wanted
+    os.environ.setdefault('NZBPO_CLEANUP', 'no')
+    load_default_options()
+
+    exit_code = load_options()
+    if exit_code is not None:
+        return exit_code
+
+    start_time = time.time()
+
+    # Walk the tree once and group video files by downloads
+    print('[INFO] Scanning %s' % root_dir)
+    with metrics.phase('inventory'):
+        inventory = file_inventory(root_dir)
+    satellite_indexes = {}
+    video_files, errors = find_video_files(root_dir)
+    downloads = []
+    download_files = {}
+    for old_path in video_files:
+        top = os.path.relpath(old_path, root_dir).split(os.sep)[0]
+        if top == os.path.basename(old_path):
+            dir = os.path.splitext(old_path)[0]
+        else:
+            dir = os.path.join(root_dir, top)
+        if dir not in download_files:
+            downloads.append(dir)
+            download_files[dir] = []
+        download_files[dir].append(old_path)
+
+    # Plan: construct new names for all files
+    plan = {}
+    tasks = []
+    for dir in downloads:
+        plan[dir] = []
+        use_nzb_name = prefer_nzb_name and len(download_files[dir]) == 1
+        tasks.extend([(old_path, dir, use_nzb_name) for old_path in download_files[dir]])
+
+    done = 0
+    last_time = start_time
+    for task, new_path, separator, vtype, failed in construct_paths(tasks):
+        old_path, dir = task[0], task[1]
+        if failed:
+            errors = True
+        elif new_path:
+            plan[dir].append((old_path, new_path, separator, vtype))
+        done += 1
+        last_time = report_progress('Guessed', done, len(video_files), start_time, last_time)
+
+    # Create destination directories before moving
+    if not preview:
+        make_dirs([os.path.dirname(entry[1]) for entries in plan.values() for entry in entries])
+
+    # Apply: move files
+    moved_count = 0
+    done = 0
+    total = sum([len(entries) for entries in plan.values()])
+    apply_time = time.time()
+    last_time = apply_time
+    for dir in downloads:
+        select_download(dir, len(download_files[dir]))
+        files_moved = False
+        download_errors = False
+        for old_path, new_path, separator, vtype in plan[dir]:
+            dupe_separator = separator
+            try:
+                with metrics.phase('move', old_path):
+                    new_path = rename(old_path, new_path)
+                add_plan_record(old_path, new_path, 'video', 'guessed as %s' % vtype)
+                files_moved = True
+                moved_count += 1
+
+                if satellites:
+                    with metrics.phase('satellites', old_path):
+                        move_satellites(old_path, new_path)
+
+            except Exception as e:
+                download_errors = True
+                print('[ERROR] Failed: %s' % old_path)
+                print('[ERROR] %s' % e)
+                traceback.print_exc()
+            done += 1
+            last_time = report_progress('Moved', done, total, apply_time, last_time)
+
+        errors = errors or download_errors
+        if cleanup and files_moved and not download_errors and os.path.isdir(dir):
+            with metrics.phase('cleanup'):
+                cleanup_download_dir()
+
+    elapsed = time.time() - start_time
+    print('[INFO] Sorted %i of %i video files in %.1f s (%.1f files/s)' %
+        (moved_count, len(video_files), elapsed, len(video_files) / elapsed if elapsed > 0 else 0))
+
+    if errors:
+        return report_metrics(POSTPROCESS_ERROR)
+    elif moved_count > 0:
+        return report_metrics(POSTPROCESS_SUCCESS)
+    else:
+        return report_metrics(POSTPROCESS_NONE)
+
+# Sort plans.
+#
+# "VideoSort.py --plan <file>" sorts a download (from environment variables
+# like NZBGet passes them) or, together with "--resort <dir>", a library
+# in preview mode and writes the moves as a plan: one json object per line
+# with source and destination path, kind (video, satellite) and reason.
+# "VideoSort.py --apply <file>" moves the files as planned without guessing
+# again, grouped by destination directories. Placement mode and other
+# options are taken as for library re-sort.
+
+# Records of the plan if a plan is written (see "add_plan_record")
+plan_records = None
+
+def add_plan_record(old, new, kind, reason):
+    """ Adds a move to the plan (if a plan is written) """
+    if plan_records is not None:
+        plan_records.append(OrderedDict([('source', old), ('destination', new), ('kind', kind), ('reason', reason)]))
+
+def write_plan(plan_path):
+    """ Writes plan records to file, as json lines """
+    with open(plan_path, 'w') as file:
+        for record in plan_records:
+            file.write(json.dumps(record) + '\n')
+    print('[INFO] Wrote plan with %i moves to %s' % (len(plan_records), plan_path))
+
+def read_plan(plan_path):
+    """ Returns list of plan records (dicts) read from file """
+    records = []
+    with open(plan_path) as file:
+        for line in file:
+            if line.strip():
+                records.append(native_strings(json.loads(line)))
+    return records
+
+def apply_plan(plan_path, options):
+    """ Moves files as recorded in plan file 'plan_path'.
+        Returns exit code.
+    """
+    global inventory
 
-for old_path in video_files:
     try:
-        new_path = construct_path(old_path)
+        records = read_plan(plan_path)
+    except (IOError, ValueError) as e:
+        print('[ERROR] Could not read plan %s: %s' % (plan_path, e))
+        return POSTPROCESS_ERROR
+    if not records:
+        print('[INFO] Plan %s is empty' % plan_path)
+        return POSTPROCESS_NONE
+
+    # Files are grouped by source directories, each is treated as a download
+    # directory with an inventory of its own (sources can be in different trees)
+    source_dirs = []
+    source_records = {}
+    for record in records:
+        source_dir = os.path.dirname(record['source'])
+        if source_dir not in source_records:
+            source_dirs.append(source_dir)
+            source_records[source_dir] = []
+        source_records[source_dir].append(record)
+
+    for name, value in options:
+        os.environ['NZBPO_' + name.upper()] = value
+    os.environ['NZBPP_DIRECTORY'] = source_dirs[0]
+    os.environ['NZBPP_NZBNAME'] = os.path.basename(source_dirs[0])
+    os.environ['NZBPP_PARSTATUS'] = '0'
+    os.environ['NZBPP_UNPACKSTATUS'] = '0'
+    load_default_options()
+
+    exit_code = load_options()
+    if exit_code is not None:
+        return exit_code
 
-        # Move video file
-        if new_path:
-            new_path = rename(old_path, new_path)
-            files_moved = True
+    if not preview:
+        make_dirs([os.path.dirname(record['destination']) for record in records])
+
+    errors = False
+    moved_count = 0
+    for source_dir in source_dirs:
+        dir_records = source_records[source_dir]
+        select_download(source_dir, len(dir_records))
+        with metrics.phase('inventory'):
+            inventory = file_inventory(source_dir, recursive=False)
+
+        # Group moves by destination directories (the order within a directory is kept)
+        dir_records.sort(key=lambda record: os.path.dirname(record['destination']))
+        for record in dir_records:
+            old_path = record['source']
+            if not inventory.contains(old_path):
+                errors = True
+                print('[ERROR] Planned file is missing: %s' % old_path)
+                continue
+            try:
+                with metrics.phase('move', old_path):
+                    rename(old_path, record['destination'])
+                moved_count += 1
+            except Exception as e:
+                errors = True
+                print('[ERROR] Failed: %s' % old_path)
+                print('[ERROR] %s' % e)
+                traceback.print_exc()
+
+    print('[INFO] Applied %i of %i planned moves' % (moved_count, len(records)))
+
+    if errors:
+        return report_metrics(POSTPROCESS_ERROR)
+    elif moved_count > 0:
+        return report_metrics(POSTPROCESS_SUCCESS)
+    else:
+        return report_metrics(POSTPROCESS_NONE)
 
-            # Move satellite files
-            if satellites:
-                move_satellites(old_path, new_path)
+# Rollback.
+#
+# "VideoSort.py --rollback <undo log>" undoes the file operations of the
+# last run recorded in the undo log and removes them from the log, so that
+# repeated rollbacks go back run by run.
+
+def read_undo_log(log_path):
+    """ Returns list of records (dicts) of the undo log """
+    records = []
+    with open(log_path) as file:
+        for line in file:
+            if line.strip():
+                records.append(native_strings(json.loads(line)))
+    return records
+
+def rollback(log_path):
+    """ Undoes the last run recorded in the undo log.
+        Returns exit code.
+    """
+    global inventory
 
-    except Exception as e:
+    try:
+        records = read_undo_log(log_path)
+    except (IOError, ValueError) as e:
+        print('[ERROR] Could not read undo log %s: %s' % (log_path, e))
+        return POSTPROCESS_ERROR
+    if not records:
+        print('[INFO] Nothing to roll back')
+        return POSTPROCESS_NONE
+
+    run = records[-1]['run']
+    operations = [record for record in records if record['run'] == run]
+    operations.reverse()
+    print('[INFO] Rolling back %i operations of run %s' % (len(operations), run))
+
+    # Operations are undone strictly in reverse order, so that chained moves
+    # (A to B, then B to C) are undone from the last one and directories are
+    # removed after the files put into them
+    inventory = None
+    errors = False
+    created_dirs = set()
+    for record in operations:
+        path = record['path']
+        if record['op'] == 'mkdir':
+            try:
+                os.rmdir(path)
+            except OSError:
+                # Not empty, other files were put there later
+                pass
+            continue
+        if record['op'] == 'delete':
+            print('[WARNING] Can not restore deleted %s' % path)
+            continue
+        try:
+            if record['op'] == 'move':
+                source_dir = os.path.dirname(record['source'])
+                if source_dir not in created_dirs and not os.path.isdir(source_dir):
+                    os.makedirs(source_dir)
+                created_dirs.add(source_dir)
+                if os.path.exists(record['source']):
+                    raise OSError(errno.EEXIST, 'File exists', record['source'])
+                optimized_move(path, record['source'])
+                print('[INFO] Restored: %s' % record['source'])
+            else:
+                os.remove(path)
+                print('[INFO] Removed: %s' % path)
+        except (IOError, OSError) as e:
+            errors = True
+            print('[ERROR] Failed: %s' % path)
+            print('[ERROR] %s' % e)
+
+    # The log is replaced atomically, a crash doesn't lose the other runs
+    temp = '%s.%i.tmp' % (log_path, os.getpid())
+    try:
+        with open(temp, 'w') as file:
+            for record in records:
+                if record['run'] != run:
+                    file.write(json.dumps(record) + '\n')
+        os.rename(temp, log_path)
+    except (IOError, OSError) as e:
         errors = True
-        print('[ERROR] Failed: %s' % old_filename)
-        print('[ERROR] %s' % e)
-        traceback.print_exc()
-
-# Inform NZBGet about new destination path
-finaldir = ''
-uniquedirs = []
-for filename in moved_dst_files:
-    dir = os.path.dirname(filename)
-    if dir not in uniquedirs:
-        uniquedirs.append(dir)
-        finaldir += '|' if finaldir != '' else ''
-        finaldir += dir
-
-if finaldir != '':
-    print('[NZB] FINALDIR=%s' % finaldir)
-
-# Cleanup if:
-# 1) files were moved AND
-# 2) no errors happen AND
-# 3) all remaining files are smaller than <MinSize>
-if cleanup and files_moved and not errors:
-    cleanup_download_dir()
-
-# Returing status to NZBGet
-if errors:
-    sys.exit(POSTPROCESS_ERROR)
-elif files_moved:
-    sys.exit(POSTPROCESS_SUCCESS)
-else:
-    sys.exit(POSTPROCESS_NONE)
+        print('[ERROR] Could not update undo log %s: %s' % (log_path, e))
+
+    if errors:
+        return POSTPROCESS_ERROR
+    return POSTPROCESS_SUCCESS
+
+# Sorter daemon.
+#
+# The daemon is started with "VideoSort.py --daemon <socket>" and keeps the
+# guessit library imported and configured between downloads. When option
+# <DaemonSocket> is set the script only forwards its environment to the daemon
+# and relays the output and the exit code back to NZBGet.
+#
+# Protocol: the client sends one line with a JSON object containing the
+# NZBGet environment variables. The daemon sends the output of the sorting,
+# followed by a zero byte and the exit code.
+
+DAEMON_EXIT_MARK = b'\0'
+
+class daemon_output:
+    """File-like object sending everything written into it to the client"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def write(self, data):
+        if isinstance(data, six.text_type):
+            data = data.encode('utf-8')
+        self.conn.sendall(data)
+
+    def flush(self):
+        pass
+
+def run_daemon(socket_path):
+    """ Serves sort requests on unix socket until interrupted """
+    load_guessit()
+    configure_guessit(guessit.api.default_api)
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(5)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print('[INFO] VideoSort daemon listening on %s' % socket_path)
+    sys.stdout.flush()
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                serve_request(conn)
+            except Exception as e:
+                print('[ERROR] Request failed: %s' % e)
+                traceback.print_exc()
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.remove(socket_path)
+    return 0
+
+def serve_request(conn):
+    """ Performs one sort request received from the client """
+    request = conn.makefile('rb').readline()
+    job_env = json.loads(request.decode('utf-8'))
+
+    # Replace environment of the previous job
+    for name in list(os.environ):
+        if name.startswith(NZBGET_ENV_PREFIXES):
+            del os.environ[name]
+    for name, value in six.iteritems(job_env):
+        if six.PY2:
+            name, value = name.encode('utf-8'), value.encode('utf-8')
+        os.environ[name] = value
+
+    output = daemon_output(conn)
+    saved_stdout, saved_stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = output
+    try:
+        try:
+            exit_code = sort_download()
+        except Exception as e:
+            print('[ERROR] %s' % e)
+            traceback.print_exc()
+            exit_code = POSTPROCESS_ERROR
+    finally:
+        sys.stdout, sys.stderr = saved_stdout, saved_stderr
+    conn.sendall(DAEMON_EXIT_MARK + str(exit_code).encode('ascii'))
+
+def sort_in_daemon(socket_path):
+    """ Hands the download over to the sorter daemon.
+        Returns exit code or None if the daemon is not available.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    job_env = dict((name, value) for name, value in six.iteritems(os.environ)
+        if name.startswith(NZBGET_ENV_PREFIXES))
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    received = False
+    try:
+        try:
+            client.connect(socket_path)
+            client.sendall(json.dumps(job_env).encode('utf-8') + b'\n')
+            out = getattr(sys.stdout, 'buffer', sys.stdout)
+            tail = b''
+            while True:
+                data = client.recv(65536)
+                if not data:
+                    break
+                received = True
+                if tail or DAEMON_EXIT_MARK in data:
+                    data, mark, exit_code = (tail + data).partition(DAEMON_EXIT_MARK)
+                    tail = mark + exit_code
+                out.write(data)
+                out.flush()
+        except (socket.error, ValueError, UnicodeError) as e:
+            if received:
+                print('[ERROR] Connection to VideoSort daemon lost: %s' % e)
+                return POSTPROCESS_ERROR
+            print('[INFO] VideoSort daemon is not available (%s), sorting in-process' % e)
+            return None
+    finally:
+        client.close()
+
+    if not tail:
+        if received:
+            print('[ERROR] Connection to VideoSort daemon lost')
+            return POSTPROCESS_ERROR
+        print('[INFO] VideoSort daemon closed connection, sorting in-process')
+        return None
+
+    return int(tail[len(DAEMON_EXIT_MARK):])
+
+def main(args):
+    global plan_records
+
+    options, _ = getopt.getopt(args, 'o:', ['daemon=', 'resort=', 'option=', 'plan=', 'apply=', 'rollback='])
+    resort_dir = None
+    plan_path = None
+    apply_path = None
+    resort_options = []
+    for opt, arg in options:
+        if opt == '--daemon':
+            return run_daemon(arg)
+        elif opt == '--rollback':
+            return rollback(arg)
+        elif opt == '--resort':
+            resort_dir = arg
+        elif opt == '--plan':
+            plan_path = arg
+        elif opt == '--apply':
+            apply_path = arg
+        elif opt in ('-o', '--option'):
+            if arg.find('=') == -1:
+                print('[ERROR] Invalid option %s, expected <Option>=<value>' % arg)
+                return POSTPROCESS_ERROR
+            resort_options.append(arg.split('=', 1))
+
+    if apply_path is not None:
+        return apply_plan(apply_path, resort_options)
+
+    if plan_path is not None:
+        # Planning is sorting in preview mode, in this process
+        plan_records = []
+        os.environ['NZBPO_PREVIEW'] = 'yes'
+        resort_options.append(('Preview', 'yes'))
+        if resort_dir is not None:
+            exit_code = resort_library(resort_dir, resort_options)
+        else:
+            exit_code = sort_download()
+        write_plan(plan_path)
+        return exit_code
+
+    if resort_dir is not None:
+        return resort_library(resort_dir, resort_options)
+
+    # Check if the script is called from nzbget 11.0 or later
+    if not 'NZBOP_SCRIPTDIR' in os.environ:
+        print('*** NZBGet post-processing script ***')
+        print('This script is supposed to be called from nzbget (11.0 or later).')
+        return POSTPROCESS_ERROR
+
+    daemon_socket = os.environ.get('NZBPO_DAEMONSOCKET', '')
+    if daemon_socket != '':
+        exit_code = sort_in_daemon(daemon_socket)
+        if exit_code is not None:
+            return exit_code
+
+    return sort_download()
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -3,7 +3,7 @@
 # that can be found in the LICENSE file.
 #
 import collections
-from pkg_resources import iter_entry_points, EntryPoint
+import importlib
 from ..exceptions import LanguageConvertError, LanguageReverseError
 
 
@@ -37,6 +37,13 @@ class CaseInsensitiveDict(collections.MutableMapping):
             data = {}
         self.update(data, **kwargs)
 
+    @classmethod
+    def from_store(cls, store):
+        """Create from a dict of lower-cased keys to tuples of key and value"""
+        instance = cls()
+        instance._store.update(store)
+        return instance
+
     def __setitem__(self, key, value):
         # Use the lowercased key for lookups, but store the actual
         # key alongside the value.
@@ -126,6 +133,9 @@ class LanguageEquivalenceConverter(LanguageReverseConverter):
     :class:`LanguageReverseConverter` by only specifying the dict from alpha3 to their corresponding symbols.
 
     You must specify the dict of equivalence as a class variable named SYMBOLS.
+    Internal converters take SYMBOLS from the precompiled tables and set the class
+    variable TABLE to its name, the reverse map is then precompiled as well (see
+    :mod:`babelfish.tables`).
 
     If you also set the class variable CASE_SENSITIVE to ``True`` then the reverse conversion function will be
     case-sensitive (it is case-insensitive by default).
@@ -138,8 +148,20 @@ class LanguageEquivalenceConverter(LanguageReverseConverter):
 
     """
     CASE_SENSITIVE = False
+    TABLE = None
 
     def __init__(self):
+        from .. import tables
+        if self.TABLE is not None and self.SYMBOLS is tables.symbols(self.TABLE):
+            reverse = tables.reverse(self.TABLE)
+            self.to_symbol = dict(self.SYMBOLS)
+            self.codes = set(self.to_symbol.values())
+            if self.CASE_SENSITIVE:
+                self.from_symbol = dict(reverse)
+            else:
+                self.from_symbol = CaseInsensitiveDict.from_store(reverse)
+            return
+
         self.codes = set()
         self.to_symbol = {}
         if self.CASE_SENSITIVE:
@@ -203,14 +225,29 @@ class CountryReverseConverter(CountryConverter):
         raise NotImplementedError
 
 
+def load_entry_point_target(target):
+    """Import the object referenced by the target of an entry point
+
+    :param string target: target in entry point syntax, e.g. ``package.module:Class``
+    :return: the referenced object
+
+    """
+    module_name, _, attrs = target.partition(':')
+    target = importlib.import_module(module_name.strip())
+    for attr in attrs.split('[')[0].strip().split('.'):
+        if attr:
+            target = getattr(target, attr)
+    return target
+
+
 class ConverterManager(object):
     """Manager for babelfish converters behaving like a dict with lazy loading
 
     Loading is done in this order:
 
-    * Entry point converters
     * Registered converters
     * Internal converters
+    * Entry point converters (only if pkg_resources is available)
 
     .. attribute:: entry_point
 
@@ -235,21 +272,21 @@ class ConverterManager(object):
         """Get a converter, lazy loading it if necessary"""
         if name in self.converters:
             return self.converters[name]
+        for converter in self.registered_converters + self.internal_converters:
+            ep_name, target = [part.strip() for part in converter.split('=', 1)]
+            if ep_name == name:
+                self.converters[name] = load_entry_point_target(target)()
+                return self.converters[name]
+        # Plugins are only looked for when needed: importing pkg_resources
+        # scans all distributions on sys.path
+        try:
+            from pkg_resources import iter_entry_points
+        except ImportError:
+            raise KeyError(name)
         for ep in iter_entry_points(self.entry_point):
             if ep.name == name:
                 self.converters[ep.name] = ep.load()()
                 return self.converters[ep.name]
-        for ep in (EntryPoint.parse(c) for c in self.registered_converters + self.internal_converters):
-            if ep.name == name:
-                # `require` argument of ep.load() is deprecated in newer versions of setuptools
-                if hasattr(ep, 'resolve'):
-                    plugin = ep.resolve()
-                elif hasattr(ep, '_load'):
-                    plugin = ep._load()
-                else:
-                    plugin = ep.load(require=False)
-                self.converters[ep.name] = plugin()
-                return self.converters[ep.name]
         raise KeyError(name)
 
     def __setitem__(self, name, converter):
@@ -6,12 +6,10 @@
 #
 from __future__ import unicode_literals
 from . import LanguageEquivalenceConverter
-from ..language import LANGUAGE_MATRIX
+from .. import tables
 
 
 class Alpha2Converter(LanguageEquivalenceConverter):
     CASE_SENSITIVE = True
-    SYMBOLS = {}
-    for iso_language in LANGUAGE_MATRIX:
-        if iso_language.alpha2:
-            SYMBOLS[iso_language.alpha3] = iso_language.alpha2
+    TABLE = 'alpha2'
+    SYMBOLS = tables.symbols(TABLE)
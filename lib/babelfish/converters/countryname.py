@@ -6,19 +6,15 @@
 #
 from __future__ import unicode_literals
 from . import CountryReverseConverter, CaseInsensitiveDict
-from ..country import COUNTRY_MATRIX
+from .. import tables
 from ..exceptions import CountryConvertError, CountryReverseError
 
 
 class CountryNameConverter(CountryReverseConverter):
     def __init__(self):
-        self.codes = set()
-        self.to_name = {}
-        self.from_name = CaseInsensitiveDict()
-        for country in COUNTRY_MATRIX:
-            self.codes.add(country.name)
-            self.to_name[country.alpha2] = country.name
-            self.from_name[country.name] = country.alpha2
+        self.to_name = dict(tables.symbols('countryname'))
+        self.codes = set(self.to_name.values())
+        self.from_name = CaseInsensitiveDict.from_store(tables.reverse('countryname'))
 
     def convert(self, alpha2):
         if alpha2 not in self.to_name:
@@ -7,27 +7,18 @@
 from __future__ import unicode_literals
 from collections import namedtuple
 from functools import partial
-from pkg_resources import resource_stream  # @UnresolvedImport
 from .converters import ConverterManager
 from .country import Country
 from .exceptions import LanguageConvertError
 from .script import Script
-from . import basestr
+from . import basestr, tables
 
 
-LANGUAGES = set()
-LANGUAGE_MATRIX = []
-
 #: The namedtuple used in the :data:`LANGUAGE_MATRIX`
 IsoLanguage = namedtuple('IsoLanguage', ['alpha3', 'alpha3b', 'alpha3t', 'alpha2', 'scope', 'type', 'name', 'comment'])
 
-f = resource_stream('babelfish', 'data/iso-639-3.tab')
-f.readline()
-for l in f:
-    iso_language = IsoLanguage(*l.decode('utf-8').split('\t'))
-    LANGUAGES.add(iso_language.alpha3)
-    LANGUAGE_MATRIX.append(iso_language)
-f.close()
+LANGUAGE_MATRIX = tables.LazyList(lambda: list(map(IsoLanguage._make, tables.rows('languages'))))
+LANGUAGES = tables.LazySet(lambda: set(iso_language.alpha3 for iso_language in LANGUAGE_MATRIX))
 
 
 class LanguageConverterManager(ConverterManager):
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 the BabelFish authors. All rights reserved.
+# Use of this source code is governed by the 3-clause BSD license
+# that can be found in the LICENSE file.
+#
+"""Precompiled data tables
+
+The tables of languages, countries and scripts are precompiled from the data
+files into ``data/tables.marshal`` with::
+
+    python -c "from babelfish import tables; tables.write()"
+
+Each column of a table is stored as one string of values separated by ``NUL``
+characters (marshal format version 2, which can be read by Python 2 and 3), so
+that loading the tables doesn't parse the data files line by line. The tables
+are loaded on first use of a module-level collection or converter, and symbols
+and reverse maps of the internal converters are built from the columns on
+first access.
+
+The precompiled tables carry the sizes of the data files they were built from
+and the version of their layout, which don't change with a checkout or an
+extraction of the package (unlike modification times) and are checked without
+reading the data files. If the file is missing or doesn't match, the tables
+are built from the data files in memory. Write them again after updating the
+data files.
+
+"""
+from __future__ import unicode_literals
+import io
+import marshal
+import os
+import pkgutil
+try:
+    from collections.abc import MutableMapping, MutableSequence, MutableSet
+except ImportError:
+    from collections import MutableMapping, MutableSequence, MutableSet
+
+
+#: Data files the tables are built from
+DATA_FILES = ['iso-639-3.tab', 'iso-3166-1.txt', 'iso15924-utf8-20131012.txt']
+
+#: Name of the precompiled tables in the data directory
+TABLES_FILE = 'tables.marshal'
+
+#: Version of the layout of the precompiled tables
+TABLES_VERSION = 3
+
+#: Separator of values in a column
+SEPARATOR = '\0'
+
+#: Columns of the language table used by the language converters
+LANGUAGE_COLUMNS = {'alpha3b': 1, 'alpha3t': 2, 'alpha2': 3, 'scope': 4, 'type': 5, 'name': 6}
+
+#: Case sensitivity of the reverse maps of the converters
+CASE_SENSITIVE = {'alpha2': True, 'alpha3b': True, 'alpha3t': True, 'name': False, 'countryname': False}
+
+_columns = None
+_symbols = {}
+_reverse = {}
+
+
+def data_path(name):
+    """Path of a file in the data directory"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', name)
+
+
+def data_stamp():
+    """Stamp of the data files (sizes) and of the layout of the precompiled tables
+
+    :rtype: tuple
+
+    """
+    return (TABLES_VERSION,) + tuple(os.path.getsize(data_path(name)) for name in DATA_FILES)
+
+
+def parse():
+    """Parse the data files
+
+    :return: rows of languages, countries and scripts
+    :rtype: tuple
+
+    """
+    f = io.BytesIO(pkgutil.get_data('babelfish', 'data/iso-639-3.tab'))
+    f.readline()
+    languages = [tuple(l.decode('utf-8').split('\t')) for l in f]
+
+    f = io.BytesIO(pkgutil.get_data('babelfish', 'data/iso-3166-1.txt'))
+    f.readline()
+    countries = [tuple(l.decode('utf-8').strip().split(';')) for l in f]
+
+    f = io.BytesIO(pkgutil.get_data('babelfish', 'data/iso15924-utf8-20131012.txt'))
+    f.readline()
+    scripts = []
+    for l in f:
+        l = l.decode('utf-8').strip()
+        if not l or l.startswith('#'):
+            continue
+        scripts.append(tuple(l.split(';')))
+    return languages, countries, scripts
+
+
+def build():
+    """Build the precompiled tables from the data files
+
+    :return: the tables with columns joined into strings
+    :rtype: dict
+
+    """
+    tables = {'stamp': data_stamp()}
+    for name, rows in zip(('languages', 'countries', 'scripts'), parse()):
+        tables[name] = [SEPARATOR.join(column) for column in zip(*rows)]
+    return tables
+
+
+def write(tables=None):
+    """Write the precompiled tables into the data directory
+
+    :param dict tables: the tables to write, built from the data files if not given
+    :return: path of the written file
+    :rtype: string
+
+    """
+    path = data_path(TABLES_FILE)
+    temp = '%s.%i.tmp' % (path, os.getpid())
+    try:
+        with open(temp, 'wb') as f:
+            marshal.dump(tables or build(), f, 2)
+        if os.path.exists(path) and os.name == 'nt':
+            os.remove(path)
+        os.rename(temp, path)
+    finally:
+        if os.path.exists(temp):
+            os.remove(temp)
+    return path
+
+
+def columns(table):
+    """Get the columns of a table, loading the tables on first access
+
+    :param string table: languages, countries or scripts
+    :return: list of columns (lists of values)
+    :rtype: list
+
+    """
+    global _columns
+    if _columns is None:
+        try:
+            with open(data_path(TABLES_FILE), 'rb') as f:
+                tables = marshal.load(f)
+            if tables.get('stamp') != data_stamp():
+                tables = None
+        except (IOError, OSError, EOFError, ValueError, TypeError, AttributeError):
+            tables = None
+        tables = tables or build()
+        _columns = dict((name, [column.split(SEPARATOR) for column in tables[name]])
+                        for name in ('languages', 'countries', 'scripts'))
+    return _columns[table]
+
+
+def rows(table):
+    """Get the rows of a table
+
+    :param string table: languages, countries or scripts
+    :return: list of tuples
+    :rtype: list
+
+    """
+    return list(zip(*columns(table)))
+
+
+def symbols(converter):
+    """Get the symbols of an internal converter: alpha3 code to symbol for the
+    language converters, alpha2 code to name for ``countryname``
+
+    :param string converter: name of the converter
+    :rtype: dict
+
+    """
+    if converter not in _symbols:
+        if converter == 'countryname':
+            names, alpha2s = columns('countries')[:2]
+            _symbols[converter] = dict(zip(alpha2s, names))
+        else:
+            language_columns = columns('languages')
+            values = language_columns[LANGUAGE_COLUMNS[converter]]
+            pairs = zip(language_columns[0], values)
+            if converter in CASE_SENSITIVE:
+                # Equivalence converters only know languages having the symbol
+                pairs = [(alpha3, symbol) for alpha3, symbol in pairs if symbol]
+            _symbols[converter] = dict(pairs)
+    return _symbols[converter]
+
+
+def reverse(converter):
+    """Get the reverse map of an internal converter: symbol to tuple of alpha3
+    code, country and script for the language converters, name to alpha2 code
+    for ``countryname``. Maps which aren't case sensitive are stored like in
+    :class:`~babelfish.converters.CaseInsensitiveDict`, by lower-cased symbol.
+
+    :param string converter: name of the converter
+    :rtype: dict
+
+    """
+    if converter not in _reverse:
+        items = symbols(converter).items()
+        if converter == 'countryname':
+            values = [alpha2 for alpha2, symbol in items]
+        else:
+            values = [(alpha3, None, None) for alpha3, symbol in items]
+        keys = [symbol for alpha3, symbol in items]
+        if CASE_SENSITIVE[converter]:
+            _reverse[converter] = dict(zip(keys, values))
+        else:
+            _reverse[converter] = dict(zip([key.lower() for key in keys], zip(keys, values)))
+    return _reverse[converter]
+
+
+class LazyCollection(object):
+    """Base of the module-level collections (:data:`~babelfish.language.LANGUAGES`,
+    :data:`~babelfish.language.LANGUAGE_MATRIX`...) which are filled from the
+    tables on first use
+
+    :param factory: function returning the content of the collection
+
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._data = None
+
+    def _load(self):
+        if self._data is None:
+            self._data = self._factory()
+        return self._data
+
+    def __len__(self):
+        return len(self._load())
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __contains__(self, item):
+        return item in self._load()
+
+    def __eq__(self, other):
+        if isinstance(other, LazyCollection):
+            other = other._load()
+        return self._load() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._load())
+
+
+class LazyList(LazyCollection, MutableSequence):
+    """A ``list`` filled on first use"""
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    def __setitem__(self, index, value):
+        self._load()[index] = value
+
+    def __delitem__(self, index):
+        del self._load()[index]
+
+    def insert(self, index, value):
+        self._load().insert(index, value)
+
+
+class LazySet(LazyCollection, MutableSet):
+    """A ``set`` filled on first use"""
+    def add(self, value):
+        self._load().add(value)
+
+    def discard(self, value):
+        self._load().discard(value)
+
+
+class LazyDict(LazyCollection, MutableMapping):
+    """A ``dict`` filled on first use"""
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+
+    def __delitem__(self, key):
+        del self._load()[key]
+
+    def keys(self):
+        return self._load().keys()
+
+    def values(self):
+        return self._load().values()
+
+    def items(self):
+        return self._load().items()
@@ -10,7 +10,8 @@ import re
 import sys
 import pickle
 from unittest import TestCase, TestSuite, TestLoader, TextTestRunner
-from pkg_resources import resource_stream  # @UnresolvedImport
+import io
+import pkgutil
 from babelfish import (LANGUAGES, Language, Country, Script, language_converters, country_converters,
     LanguageReverseConverter, LanguageConvertError, LanguageReverseError, CountryReverseError)
 
@@ -216,7 +217,7 @@ class TestLanguage(TestCase, _Py26FixTestCase):
 
         # test with all the LANGUAGES from the opensubtitles api
         # downloaded from: http://www.opensubtitles.org/addons/export_languages.php
-        f = resource_stream('babelfish', 'data/opensubtitles_languages.txt')
+        f = io.BytesIO(pkgutil.get_data('babelfish', 'data/opensubtitles_languages.txt'))
         f.readline()
         for l in f:
             idlang, alpha2, _, upload_enabled, web_enabled = l.decode('utf-8').strip().split('\t')
@@ -33,3 +33,52 @@ def build_or_pattern(patterns, name=None, escape=False):
         or_pattern.append('(?:%s)' % re.escape(pattern) if escape else pattern)
     or_pattern.append(')')
     return ''.join(or_pattern)
+
+
+def build_trie_pattern(strings, name=None):
+    """
+    Build a or pattern string matching any of the given strings, with the strings merged into a prefix tree.
+
+    It matches the same strings as build_or_pattern(strings, escape=True), but the regex engine doesn't have to try
+    each string in turn. Longer strings are tried before their prefixes.
+
+    :param strings: strings to match literally
+    :type strings: list[str]
+    :param name: name of the group, if any
+    :type name: str
+    :return: the pattern string
+    :rtype: str
+    """
+    trie = {}
+    for string in strings:
+        node = trie
+        for char in string:
+            node = node.setdefault(char, {})
+        node[''] = None
+
+    def node_pattern(node):
+        """
+        Build the pattern of the branches from a node of the prefix tree.
+        """
+        chars = []
+        branches = []
+        for char in sorted(key for key in node if key):
+            child = node[char]
+            if list(child) == ['']:
+                chars.append(re.escape(char))
+            else:
+                branches.append(re.escape(char) + node_pattern(child))
+        if len(chars) == 1:
+            branches.append(chars[0])
+        elif chars:
+            branches.append('[' + ''.join(chars) + ']')
+        if len(branches) == 1 and ('' not in node or len(branches[0]) == 1 or len(chars) > 1):
+            pattern = branches[0]
+        else:
+            pattern = '(?:' + '|'.join(branches) + ')'
+        return pattern + '?' if '' in node else pattern
+
+    pattern = node_pattern(trie) if trie else ''
+    if name:
+        return '(?P<' + name + '>' + pattern + ')'
+    return '(?:' + pattern + ')'
@@ -53,6 +53,7 @@ class GuessitCountryConverter(babelfish.CountryReverseConverter):  # pylint: dis
         for alpha2, synlist in synonyms.items():
             for syn in synlist:
                 self.guessit_exceptions[syn.lower()] = alpha2
+        self._reverse_index = None
 
     @property
     def codes(self):  # pylint: disable=missing-docstring
@@ -60,31 +61,41 @@ class GuessitCountryConverter(babelfish.CountryReverseConverter):  # pylint: dis
                 frozenset(babelfish.COUNTRIES.values()) |
                 frozenset(self.guessit_exceptions.keys()))
 
+    @property
+    def reverse_index(self):
+        """
+        Lower-cased code, name or synonym to alpha2, built on first access.
+
+        Exceptions override alpha2 codes, which override names.
+        """
+        if self._reverse_index is None:
+            index = dict(babelfish.country_converters['name'].from_name.lower_items())
+            index.update((alpha2.lower(), alpha2) for alpha2 in babelfish.COUNTRIES)
+            index.update(self.guessit_exceptions)
+            self._reverse_index = index
+        return self._reverse_index
+
     def convert(self, alpha2):
         if alpha2 == 'GB':
             return 'UK'
         return str(babelfish.Country(alpha2))
 
-    def reverse(self, name):  # pylint:disable=arguments-differ
-        # exceptions come first, as they need to override a potential match
-        # with any of the other guessers
-        try:
-            return self.guessit_exceptions[name.lower()]
-        except KeyError:
-            pass
-
-        try:
-            return babelfish.Country(name.upper()).alpha2
-        except ValueError:
-            pass
+    def find(self, name):
+        """
+        Reverse the given name like :meth:`reverse`, but return None if it's not a country.
 
-        for conv in [babelfish.Country.fromname]:
-            try:
-                return conv(name).alpha2
-            except babelfish.CountryReverseError:
-                pass
+        :param name: code, name or synonym
+        :type name: str
+        :return: alpha2 or None
+        :rtype: str
+        """
+        return self.reverse_index.get(name.lower())
 
-        raise babelfish.CountryReverseError(name)
+    def reverse(self, name):  # pylint:disable=arguments-differ
+        alpha2 = self.find(name)
+        if alpha2 is None:
+            raise babelfish.CountryReverseError(name)
+        return alpha2
 
 
 class CountryFinder(object):
@@ -101,14 +112,15 @@ class CountryFinder(object):
             if word.lower() in self.common_words:
                 continue
 
-            try:
-                country_object = babelfish.Country.fromguessit(word)
-                if (country_object.name.lower() in self.allowed_countries or
-                        country_object.alpha2.lower() in self.allowed_countries):
-                    yield self._to_rebulk_match(word_match, country_object)
-            except babelfish.Error:
+            alpha2 = babelfish.country_converters['guessit'].find(word)
+            if alpha2 is None:
                 continue
 
+            country_object = babelfish.Country(alpha2)
+            if (country_object.name.lower() in self.allowed_countries or
+                    country_object.alpha2.lower() in self.allowed_countries):
+                yield self._to_rebulk_match(word_match, country_object)
+
     @classmethod
     def _to_rebulk_match(cls, word, value):
         return word.span[0], word.span[1], {'value': value}
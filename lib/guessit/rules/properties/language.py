@@ -87,6 +87,7 @@ class GuessitConverter(babelfish.LanguageReverseConverter):  # pylint: disable=m
                 (alpha3, country) = (code, None)
             for syn in synlist:
                 self.guessit_exceptions[syn.lower()] = (alpha3, country, None)
+        self._reverse_index = None
 
     @property
     def codes(self):  # pylint: disable=missing-docstring
@@ -97,31 +98,59 @@ class GuessitConverter(babelfish.LanguageReverseConverter):  # pylint: disable=m
                 babelfish.country_converters['name'].codes |
                 frozenset(self.guessit_exceptions.keys()))
 
+    @property
+    def reverse_index(self):
+        """
+        Lower-cased code, name or synonym to (alpha3, country, script), built on first access.
+
+        Entries are added from the last to the first of the converters tried by babelfish, so that exceptions
+        override alpha3 codes, which override alpha3b codes, alpha2 codes, names and opensubtitles codes.
+        """
+        if self._reverse_index is None:
+            index = {}
+            opensubtitles = babelfish.language_converters['opensubtitles']
+            for code, value in opensubtitles.from_opensubtitles.lower_items():
+                try:
+                    language = babelfish.Language(*value)
+                except ValueError:
+                    continue
+                index[code] = (language.alpha3, language.country, language.script)
+            index.update(babelfish.language_converters['name'].from_symbol.lower_items())
+            for converter in ('alpha2', 'alpha3b'):
+                from_symbol = babelfish.language_converters[converter].from_symbol
+                index.update((code, value) for code, value in from_symbol.items() if code == code.lower())
+            index.update((alpha3, (alpha3, None, None)) for alpha3 in babelfish.LANGUAGES)
+            index.update(self.guessit_exceptions)
+            self._reverse_index = index
+        return self._reverse_index
+
     def convert(self, alpha3, country=None, script=None):
         return str(babelfish.Language(alpha3, country, script))
 
-    def reverse(self, name):  # pylint:disable=arguments-differ
+    def find(self, name):
+        """
+        Reverse the given name like :meth:`reverse`, but return None if it's not a language.
+
+        :param name: code, name or synonym
+        :type name: str
+        :return: (alpha3, country, script) or None
+        :rtype: tuple
+        """
         name = name.lower()
-        # exceptions come first, as they need to override a potential match
-        # with any of the other guessers
-        try:
-            return self.guessit_exceptions[name]
-        except KeyError:
-            pass
-
-        for conv in [babelfish.Language,
-                     babelfish.Language.fromalpha3b,
-                     babelfish.Language.fromalpha2,
-                     babelfish.Language.fromname,
-                     babelfish.Language.fromopensubtitles,
-                     babelfish.Language.fromietf]:
+        result = self.reverse_index.get(name)
+        if result is None and '-' in name:
             try:
-                reverse = conv(name)
-                return reverse.alpha3, reverse.country, reverse.script
+                result = babelfish.Language.fromietf(name)
             except (ValueError, babelfish.LanguageReverseError):
-                pass
+                return None
+            return result.alpha3, result.country, result.script
+        return result
 
-        raise babelfish.LanguageReverseError(name)
+    def reverse(self, name):  # pylint:disable=arguments-differ
+        result = self.find(name)
+        if result is None:
+            raise babelfish.LanguageReverseError(name)
+        return result
 
 
 def length_comparator(value):
@@ -346,15 +375,15 @@ class LanguageFinder(object):
 
         Multi and Undetermined languages are also valid languages.
         """
-        try:
-            lang = babelfish.Language.fromguessit(lang_word)
-            if ((hasattr(lang, 'name') and lang.name.lower() in self.allowed_languages) or
-                    (hasattr(lang, 'alpha2') and lang.alpha2.lower() in self.allowed_languages) or
-                    lang.alpha3.lower() in self.allowed_languages):
-                return lang
-
-        except babelfish.Error:
-            pass
+        lang = babelfish.language_converters['guessit'].find(lang_word)
+        if lang is None:
+            return None
+
+        lang = babelfish.Language(*lang)
+        if ((hasattr(lang, 'name') and lang.name.lower() in self.allowed_languages) or
+                (hasattr(lang, 'alpha2') and lang.alpha2.lower() in self.allowed_languages) or
+                lang.alpha3.lower() in self.allowed_languages):
+            return lang
 
 
 class SubtitlePrefixLanguageRule(Rule):
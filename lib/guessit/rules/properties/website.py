@@ -3,7 +3,9 @@
 """
 Website property.
 """
-from pkg_resources import resource_stream  # @UnresolvedImport
+import io
+import pkgutil
+
 from rebulk.remodule import re
 
 from rebulk import Rebulk, Rule, RemoveMatch
@@ -11,7 +13,7 @@ from ..common import seps
 from ..common.formatters import cleanup
 from ..common.pattern import is_disabled
 from ..common.validators import seps_surround
-from ...reutils import build_or_pattern
+from ...reutils import build_or_pattern, build_trie_pattern
 
 
 def website(config):
@@ -27,7 +29,7 @@ def website(config):
     rebulk = rebulk.regex_defaults(flags=re.IGNORECASE).string_defaults(ignore_case=True)
     rebulk.defaults(name="website")
 
-    with resource_stream('guessit', 'tlds-alpha-by-domain.txt') as tld_file:
+    with io.BytesIO(pkgutil.get_data('guessit', 'tlds-alpha-by-domain.txt')) as tld_file:
         tlds = [
             tld.strip().decode('utf-8')
             for tld in tld_file.readlines()
@@ -39,8 +41,10 @@ def website(config):
     safe_prefix = config['safe_prefixes']  # Those words before a tlds are sure
     website_prefixes = config['prefixes']
 
+    tlds_pattern = build_trie_pattern(tlds)
+
     rebulk.regex(r'(?:[^a-z0-9]|^)((?:'+build_or_pattern(safe_subdomains) +
-                 r'\.)+(?:[a-z-]+\.)+(?:'+build_or_pattern(tlds) +
+                 r'\.)+(?:[a-z-]+\.)+(?:'+tlds_pattern +
                  r'))(?:[^a-z0-9]|$)',
                  children=True)
     rebulk.regex(r'(?:[^a-z0-9]|^)((?:'+build_or_pattern(safe_subdomains) +
@@ -49,7 +53,7 @@ def website(config):
                  safe_subdomains=safe_subdomains, safe_tlds=safe_tlds, children=True)
     rebulk.regex(r'(?:[^a-z0-9]|^)((?:'+build_or_pattern(safe_subdomains) +
                  r'\.)*[a-z-]+\.(?:'+build_or_pattern(safe_prefix) +
-                 r'\.)+(?:'+build_or_pattern(tlds) +
+                 r'\.)+(?:'+tlds_pattern +
                  r'))(?:[^a-z0-9]|$)',
                  safe_subdomains=safe_subdomains, safe_prefix=safe_prefix, tlds=tlds, children=True)
 
@@ -339,6 +339,7 @@ class StringPattern(Pattern):
         self._patterns = patterns
         self._kwargs = kwargs
         self._match_kwargs = filter_match_kwargs(kwargs)
+        self.automaton = None
 
     @property
     def patterns(self):
@@ -348,8 +349,26 @@ class StringPattern(Pattern):
     def match_options(self):
         return self._match_kwargs
 
+    @property
+    def automaton_options(self):
+        """
+        Case mode of the automaton this pattern can be merged into, or None if it can't.
+
+        :return: ignore_case option, or None
+        :rtype: bool
+        """
+        if self._kwargs.get('start') is not None or self._kwargs.get('end') is not None:
+            return None
+        if not all(isinstance(pattern, six.string_types) for pattern in self._patterns):
+            return None
+        return bool(self._kwargs.get('ignore_case'))
+
     def _match(self, pattern, input_string, context=None):
-        for index in find_all(input_string, pattern, **self._kwargs):
+        if self.automaton is not None:
+            indices = self.automaton.find_all(input_string, pattern)
+        else:
+            indices = find_all(input_string, pattern, **self._kwargs)
+        for index in indices:
             yield Match(index, index + len(pattern), pattern=self, input_string=input_string, **self._match_kwargs)
 
 
@@ -12,7 +12,7 @@ from .chain import Chain
 
 from .processors import ConflictSolver, PrivateRemover
 from .loose import set_defaults
-from .utils import extend_safe
+from .utils import extend_safe, StringsAutomaton
 from .rules import Rules
 
 log = getLogger(__name__).log
@@ -70,6 +70,7 @@ class Rebulk(object):
         self._functional_defaults = {}
         self._chain_defaults = {}
         self._rebulks = []
+        self._automatons_key = None
 
     def pattern(self, *pattern):
         """
@@ -332,6 +333,34 @@ class Rebulk(object):
                 extend_safe(patterns, rebulk._patterns)
         return patterns
 
+    def _build_automatons(self):
+        """
+        Merge the strings of string patterns of this rebulk object and its children into one automaton per case mode,
+        so that a single pass over the input string finds the occurrences for all of them. Matches are still built,
+        formatted and validated by each pattern.
+
+        Automatons are built again only if patterns or children were added since the last build.
+        :return:
+        :rtype:
+        """
+        key = (len(self._patterns), len(self._rebulks)) + tuple(len(rebulk._patterns) for rebulk in self._rebulks)
+        if key == self._automatons_key:
+            return
+
+        patterns = [pattern for pattern in self._patterns if isinstance(pattern, StringPattern)]
+        for rebulk in self._rebulks:
+            patterns.extend(pattern for pattern in rebulk._patterns if isinstance(pattern, StringPattern))
+        strings = {}
+        for pattern in patterns:
+            ignore_case = pattern.automaton_options
+            if ignore_case is not None:
+                strings.setdefault(ignore_case, []).extend(pattern.patterns)
+        automatons = dict((ignore_case, StringsAutomaton(case_strings, ignore_case=ignore_case))
+                          for ignore_case, case_strings in strings.items())
+        for pattern in patterns:
+            pattern.automaton = automatons.get(pattern.automaton_options)
+        self._automatons_key = key
+
     def _matches_patterns(self, matches, context):
         """
         Search for all matches with current paterns agains input_string
@@ -344,6 +373,7 @@ class Rebulk(object):
         """
         if not self.disabled(context):
             patterns = self.effective_patterns(context)
+            self._build_automatons()
             for pattern in patterns:
                 if not pattern.disabled(context):
                     pattern_matches = pattern.matches(matches.input_string, context)
@@ -3,7 +3,7 @@
 """
 Various utilities functions
 """
-from collections import MutableSet
+from collections import MutableSet, deque
 
 from types import GeneratorType
 
@@ -53,6 +53,117 @@ def find_all(string, sub, start=None, end=None, ignore_case=False, **kwargs):
         start += len(sub)
 
 
+class StringsAutomaton(object):
+    """
+    Aho-Corasick automaton finding the occurrences of many strings in a single pass over the input string.
+
+    >>> automaton = StringsAutomaton(['he', 'she', 'his', 'hers'])
+    >>> sorted(automaton.occurrences('ushers').items())
+    [('he', [2]), ('hers', [2]), ('she', [1])]
+
+    >>> list(automaton.find_all('she sells seashells', 'she'))
+    [0, 13]
+
+    >>> list(StringsAutomaton(['aa']).find_all('aaaaa', 'aa'))
+    [0, 2]
+
+    >>> list(StringsAutomaton(['The'], ignore_case=True).find_all('The quick brown fox jumps over the lazy dog', 'THE'))
+    [0, 31]
+    """
+
+    def __init__(self, strings, ignore_case=False):
+        """
+        :param strings: the strings to search for
+        :type strings: list[str]
+        :param ignore_case: search case insensitively
+        :type ignore_case: bool
+        """
+        self.ignore_case = ignore_case
+        self.strings = set()
+        self._goto = [{}]
+        self._output = [[]]
+        for string in strings:
+            if ignore_case:
+                string = string.lower()
+            if not string or string in self.strings:
+                continue
+            self.strings.add(string)
+            state = 0
+            for char in string:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(string)
+
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                self._output[next_state].extend(self._output[fail])
+        self._last = (None, None)
+
+    def occurrences(self, string):
+        """
+        Return start indices of all occurrences, overlapping ones included, of the strings found in the input string.
+
+        The result of the last input string is kept, as it's usually searched again for other strings.
+        :param string: the input string
+        :type string: str
+        :return: indices for each string found
+        :rtype: dict[str, list[int]]
+        """
+        last_string, occurrences = self._last
+        if last_string is not None and last_string == string:
+            return occurrences
+        occurrences = {}
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        for index, char in enumerate(string.lower() if self.ignore_case else string):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for found in output[state]:
+                occurrences.setdefault(found, []).append(index + 1 - len(found))
+        self._last = (string, occurrences)
+        return occurrences
+
+    def find_all(self, string, sub):
+        """
+        Return all indices in string where substring sub is found, like :func:`find_all`.
+
+        :param string: the input string
+        :type string: str
+        :param sub: the substring
+        :type sub: str
+        :return: all indices in the input string
+        :rtype: __generator[int]
+        """
+        if self.ignore_case:
+            sub = sub.lower()
+        if sub not in self.strings:
+            for index in find_all(string, sub, ignore_case=self.ignore_case):
+                yield index
+            return
+        end = 0
+        for index in self.occurrences(string).get(sub, ()):
+            if index >= end:
+                yield index
+                end = index + len(sub)
+
+
 def get_first_defined(data, keys, default_value=None):
     """
     Get the first defined key in data.
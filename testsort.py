@@ -27,24 +27,38 @@ import shutil
 import subprocess
 import json
 import getopt
+import time
+import tempfile
 
 print('Test script for VideoSort')
 
 root_dir = dirname(__file__)
 test_dir = root_dir + '/__'
 verbose = False
+daemon = False
 test_ids = []
 
-options, _ = getopt.getopt(sys.argv[1:], 't:v', ['testid=', 'verbose'])
+options, _ = getopt.getopt(sys.argv[1:], 't:vd', ['testid=', 'verbose', 'daemon'])
 for opt, arg in options:
 	if opt in ('-v', '--verbose'):
 		verbose = True
 	elif opt in ('-t', '--testid'):
 		test_ids.append(arg)
+	elif opt in ('-d', '--daemon'):
+		daemon = True
+
+daemon_socket = root_dir + '/videosort-test.sock'
+
+# Options set by a test must not remain for the next tests
+initial_environ = os.environ.copy()
 
 def set_defaults():
+	os.environ.clear()
+	os.environ.update(initial_environ)
+
 	# NZBGet global options
 	os.environ['NZBOP_SCRIPTDIR'] = 'test'
+	os.environ['NZBOP_TEMPDIR'] = tempfile.gettempdir()
 
 	# script options
 	os.environ['NZBPO_MOVIESDIR'] = root_dir + '/movies'
@@ -68,6 +82,7 @@ def set_defaults():
 	os.environ['NZBPO_CLEANUP'] = 'no'
 	os.environ['NZBPO_PREVIEW'] = 'yes'
 	os.environ['NZBPO_VERBOSE'] = 'yes'
+	os.environ['NZBPO_DAEMONSOCKET'] = daemon_socket if daemon else ''
 
 	# properties of nzb-file
 	os.environ['NZBPP_DIRECTORY'] = test_dir
@@ -81,28 +96,68 @@ def set_defaults():
 	os.environ['NZBPR__DNZB_PROPERNAME'] = ''
 	os.environ['NZBPR__DNZB_EPISODENAME'] = ''
 
+# Destination directories of the default options, created by tests with
+# NZBPO_PREVIEW=no
+output_dirs = ['movies', 'series', 'dated', 'tv']
+
+def remove_output():
+	for name in output_dirs:
+		shutil.rmtree(root_dir + '/' + name, True)
+
+def expand(value):
+	# Paths in tests are given relative to root dir as "{root}/..."
+	return value.replace('{root}', root_dir)
+
 def run_test(testobj):
 	set_defaults()
 	for prop_name in testobj:
-		os.environ[str(prop_name)] = str(testobj[prop_name])
+		# Lists are test parameters (FILES, ARGS, RUNS, EXISTS, MISSING), not options
+		if isinstance(testobj[prop_name], list):
+			continue
+		os.environ[str(prop_name)] = expand(str(testobj[prop_name]))
 		if verbose:
 			print('%s: %s' % (prop_name, os.environ[prop_name]))
 	input_file = testobj['INPUTFILE']
 	output_file = testobj['OUTPUTFILE']
 	shutil.rmtree(test_dir, True)
+	remove_output()
 	os.mkdir(test_dir)
-	dir_name, file_name = os.path.split(input_file)
-	if dir_name <> '':
-		os.mkdir(test_dir + '/' + dir_name)
-	full_file_name = test_dir + '/' + input_file
-	out_file = open(full_file_name, 'w')
-	out_file.write('empty file')
-	out_file.close()
+	# Other files of the download (subtitles, etc.), files starting with "/"
+	# are relative to root dir (such as files already at the destination)
+	for file_name in [input_file] + testobj.get('FILES', []):
+		if file_name.startswith('/'):
+			full_file_name = root_dir + file_name
+		else:
+			full_file_name = test_dir + '/' + file_name
+		dir_name = os.path.dirname(full_file_name)
+		if not os.path.isdir(dir_name):
+			os.makedirs(dir_name)
+		out_file = open(full_file_name, 'w')
+		out_file.write('empty file')
+		out_file.close()
+
+	# Copy of the input file to the output file interrupted after JOURNAL
+	# bytes: partial temporary file and journal of VideoSort
+	if 'JOURNAL' in testobj:
+		copied = int(testobj['JOURNAL'])
+		source = test_dir + '/' + input_file
+		target = root_dir + output_file
+		temp = os.path.dirname(target) + '/.' + os.path.basename(target) + '.part'
+		os.makedirs(os.path.dirname(target))
+		out_file = open(temp, 'w')
+		out_file.write('empty file'[:copied])
+		out_file.close()
+		stat = os.stat(source)
+		journal = {source: {'new': target, 'temp': temp, 'size': stat.st_size, 'mtime': stat.st_mtime, 'copied': copied}}
+		out_file = open(test_dir + '/.videosort-journal', 'w')
+		json.dump(journal, out_file)
+		out_file.close()
 
 	if verbose:
 		print('Executing...')
 	sys.stdout.flush()
-	proc = subprocess.Popen(['python', root_dir + '/VideoSort.py'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=os.environ.copy())
+	args = [expand(arg) for arg in testobj.get('ARGS', [])]
+	proc = subprocess.Popen(['python', root_dir + '/VideoSort.py'] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=os.environ.copy())
 	out, err = proc.communicate()
 	out += err
 	ret = proc.returncode
@@ -111,6 +166,10 @@ def run_test(testobj):
 	success = False
 	dest = ''
 
+	if daemon and 'sorting in-process' in out:
+		print('%s: daemon not used' % testobj['id'])
+		ret = -1
+
 	if ret == 93:
 		for line in out.split('\n'):
 			if line.startswith('destination path: '):
@@ -119,6 +178,39 @@ def run_test(testobj):
 					line = line[len(root_dir):]
 				dest = line.replace('\\', '/')
 		success = dest == output_file and output_file <> ''
+		# Number of guessit calls (metrics counter), if the test expects one
+		if success and 'GUESSITCALLS' in testobj:
+			m = re.search(r'guessit_calls (\d+)', out)
+			calls = m.group(1) if m else ''
+			success = calls == testobj['GUESSITCALLS']
+			if not success:
+				print('%s: guessit calls %s, expected %s' % (testobj['id'], calls, testobj['GUESSITCALLS']))
+
+	# Further runs with other arguments (such as applying a plan), each must succeed
+	for args in testobj.get('RUNS', []):
+		if not success:
+			break
+		args = [expand(arg) for arg in args]
+		proc = subprocess.Popen(['python', root_dir + '/VideoSort.py'] + args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=os.environ.copy())
+		out += proc.communicate()[0]
+		if proc.returncode != 93:
+			print('%s: %s returned %i' % (testobj['id'], ' '.join(args), proc.returncode))
+			success = False
+
+	if success and 'JOURNAL' in testobj:
+		success = 'Resuming interrupted copy' in out and open(root_dir + output_file).read() == 'empty file'
+		if not success:
+			print('%s: interrupted copy not resumed' % testobj['id'])
+
+	# Files (relative to root dir) which must or must not exist after the run
+	for file_name in testobj.get('EXISTS', []):
+		if success and not os.path.exists(root_dir + file_name):
+			print('%s: missing %s' % (testobj['id'], file_name))
+			success = False
+	for file_name in testobj.get('MISSING', []):
+		if success and os.path.exists(root_dir + file_name):
+			print('%s: not expected %s' % (testobj['id'], file_name))
+			success = False
 
 	if success:
 		print('%s: SUCCESS' % testobj['id'])
@@ -141,7 +233,18 @@ def run_test(testobj):
 		print('expected   : %s' % output_file)
 		print('destination: %s' % dest)
 
+if daemon:
+	daemon_proc = subprocess.Popen(['python', root_dir + '/VideoSort.py', '--daemon', daemon_socket])
+	while not os.path.exists(daemon_socket):
+		time.sleep(0.1)
+
 testdata = json.load(open(root_dir + '/testdata.json'))
 for testobj in testdata:
 	if test_ids == [] or testobj['id'] in test_ids:
 		run_test(testobj)
+
+remove_output()
+
+if daemon:
+	daemon_proc.terminate()
+	daemon_proc.wait()